@@ -1,22 +1,42 @@
 #!/usr/bin/env python3
 """Parse date/time from paths using glob wildcard pattern intertwined with a subset of strftime directives."""
+# pylint: disable=too-many-lines
 
+import abc
+import array
+import bisect
 import calendar
 import collections
+import concurrent.futures
 import copy
 import datetime
+import errno
+import itertools
+import json
 import os
 import pathlib
+import random
 import re
-from typing import Iterable, List, MutableMapping, Optional, Pattern, Tuple, Union
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from stat import S_ISDIR, S_ISLNK
+from typing import (IO, Any, Callable, Deque, Dict, Generator, Generic, Iterable, Iterator, List, MutableMapping,
+                    Optional, Pattern, Sequence, Set, Tuple, Type, TypeVar, Union, overload)
 
 import lexery
 
 # yapf: disable
 LEXER = lexery.Lexer(
     rules=[
+        lexery.Rule(identifier='**', pattern=re.compile(r'\*\*')),
         lexery.Rule(identifier='*', pattern=re.compile(r'\*')),
         lexery.Rule(identifier='?', pattern=re.compile(r'\?')),
+        lexery.Rule(identifier='alternatives', pattern=re.compile(r'\{[^{}*?%\[\],]*(,[^{}*?%\[\],]*)+\}')),
+        lexery.Rule(identifier='class', pattern=re.compile(r'\[!?(\]|[^\]])[^\]]*\]')),
         lexery.Rule(identifier='%d', pattern=re.compile(r'%d')),
         lexery.Rule(identifier='%-d', pattern=re.compile(r'%-d')),
         lexery.Rule(identifier='%m', pattern=re.compile(r'%m')),
@@ -36,10 +56,63 @@ LEXER = lexery.Lexer(
 )
 # yapf: enable
 
+# rank of the date/time field set by a directive, from the most to the least significant
+FIELD_RANKS = {
+    '%Y': 0,
+    '%y': 0,
+    '%m': 1,
+    '%-m': 1,
+    '%d': 2,
+    '%-d': 2,
+    '%H': 3,
+    '%-H': 3,
+    '%M': 4,
+    '%-M': 4,
+    '%S': 5,
+    '%-S': 5,
+    '%f': 6
+}
+
+# directives whose values are rendered with a fixed width
+ZERO_PADDED_DIRECTIVES = frozenset(['%Y', '%y', '%m', '%d', '%H', '%M', '%S', '%f'])
+
+# tokens which match a variable text
+WILDCARD_TOKENS = frozenset(['**', '*', '?', 'alternatives', 'class'])
+
+# maximum number of the candidate names of a pattern segment which are looked up directly instead of listing
+# the directory
+MAX_CANDIDATES = 1024
+
+# names of the date/time fields from the most to the least significant
+FIELD_NAMES = ('year', 'month', 'day', 'hour', 'minute', 'second', 'microsecond')
+
+# str.format replacement field of a directive; the positional arguments are the date/time fields in order of
+# FIELD_NAMES followed by the two-digit year
+FORMAT_FIELDS = {
+    '%d': '{2:02d}',
+    '%-d': '{2:d}',
+    '%m': '{1:02d}',
+    '%-m': '{1:d}',
+    '%y': '{7:02d}',
+    '%Y': '{0:04d}',
+    '%H': '{3:02d}',
+    '%-H': '{3:d}',
+    '%M': '{4:02d}',
+    '%-M': '{4:d}',
+    '%S': '{5:02d}',
+    '%-S': '{5:d}',
+    '%f': '{6:06d}'
+}
+
+# number of positional arguments of a template preceding the wildcard texts
+FORMAT_FIELD_COUNT = 8
+
 
 class PatternSegment:
     """Define a regular expression for a given path segment."""
 
+    # pylint: disable=too-many-instance-attributes
+
     def __init__(self) -> None:
         """Initialize with empty values."""
         self.regex = None  # type: Optional[Pattern[str]]
@@ -50,8 +123,27 @@ class PatternSegment:
         # group index -> token class, sorted by group index
         self.group_map = collections.OrderedDict()  # type: MutableMapping[int, str]
 
+        # set if the segment is a recursive wildcard ('**') matching zero or more path segments
+        self.recursive = False
+
+        # (identifier, content) of the tokens of the segment
+        self.tokens = []  # type: List[Tuple[str, str]]
+
+        # set if the lexicographical order of the matching names equals the chronological order
+        self.order_preserving = False
+
+        # captures the texts matched by the wildcards in order of appearance; set only if there are any wildcards
+        self.wildcard_regex = None  # type: Optional[Pattern[str]]
+
+        # sorted names matching the segment; set only if the segment consists of the text and the alternatives
+        # so that the entries can be looked up directly instead of listing the directory
+        self.candidates = None  # type: Optional[List[str]]
+
     def __repr__(self) -> str:
         """Represent the pattern segment succenctly, but not ``eval``-able."""
+        if self.recursive:
+            return 'PatternSegment(recursive=True)'
+
         return 'PatternSegment(regex={}, text={}, group_map={})'.format(self.regex, self.text, self.group_map)
 
 
@@ -68,10 +160,16 @@ def __tokens_as_fixed_text(tokens: List[lexery.Token]) -> Optional[PatternSegmen
     # pylint: disable=too-many-return-statements
     parts = []  # type: List[str]
     for token in tokens:
-        if token.identifier == '*':
+        if token.identifier == '**':
+            return None
+        elif token.identifier == '*':
             return None
         elif token.identifier == '?':
             return None
+        elif token.identifier == 'alternatives':
+            return None
+        elif token.identifier == 'class':
+            return None
         elif token.identifier == '%d':
             return None
         elif token.identifier == '%-d':
@@ -107,9 +205,37 @@ def __tokens_as_fixed_text(tokens: List[lexery.Token]) -> Optional[PatternSegmen
 
     patseg = PatternSegment()
     patseg.text = ''.join(parts)
+    patseg.tokens = [(token.identifier, token.content) for token in tokens]
+    patseg.order_preserving = True
     return patseg
 
 
+def _class_as_regex(content: str) -> str:
+    """
+    Translate the character class of a glob pattern (*e.g.*, ``[a-c]`` or ``[!0-9]``) to a regular expression.
+
+    :param content: of the class including the brackets
+    :return: regular expression of the class
+    :raises: ValueError if the class is invalid (*e.g.*, a reversed range ``[z-a]``)
+    """
+    chars = content[1:-1]
+
+    negated = chars.startswith('!')
+    if negated:
+        chars = chars[1:]
+
+    # escape the characters which have a special meaning in a class of a regular expression, but not in glob
+    chars = re.sub(r'([\\\[&~|^])', r'\\\1', chars)
+
+    regex = '[' + ('^' if negated else '') + chars + ']'
+    try:
+        re.compile(regex)
+    except re.error as err:
+        raise ValueError("Invalid character class {}: {}".format(content, err)) from err
+
+    return regex
+
+
 def __tokens_as_pattern_segment(tokens: List[lexery.Token]) -> PatternSegment:
     """
     Parse tokens to a pattern segment.
@@ -122,12 +248,23 @@ def __tokens_as_pattern_segment(tokens: List[lexery.Token]) -> PatternSegment:
     patseg = PatternSegment()
     group = 1  # group index in the regular expression, used to map groups to token classes
 
+    if len(tokens) == 1 and tokens[0].identifier == '**':
+        patseg.recursive = True
+
     regex_parts = ['^']
     for token in tokens:
-        if token.identifier == '*':
+        if token.identifier == '**':
+            # within a segment, the double wildcard is equivalent to a single one.
+            regex_parts.append('.*')
+        elif token.identifier == '*':
             regex_parts.append('.*')
         elif token.identifier == '?':
             regex_parts.append('.')
+        elif token.identifier == 'alternatives':
+            regex_parts.append('(?:' + '|'.join(re.escape(alternative)
+                                                for alternative in token.content[1:-1].split(',')) + ')')
+        elif token.identifier == 'class':
+            regex_parts.append(_class_as_regex(token.content))
         elif token.identifier == '%d':
             regex_parts.append('(0[1-9]|1[0-9]|2[0-9]|3[0-1])')
             patseg.group_map[group] = token.identifier
@@ -189,6 +326,56 @@ def __tokens_as_pattern_segment(tokens: List[lexery.Token]) -> PatternSegment:
 
     regex_parts.append('$')
     patseg.regex = re.compile(''.join(regex_parts))
+    patseg.tokens = [(token.identifier, token.content) for token in tokens]
+
+    if not patseg.recursive and any(token.identifier in WILDCARD_TOKENS for token in tokens):
+        wildcard_parts = ['^']
+        for token, regex_part in zip(tokens, regex_parts[1:-1]):
+            if token.identifier in WILDCARD_TOKENS:
+                wildcard_parts.append('(' + regex_part + ')')
+            elif token.identifier in FIELD_RANKS:
+                # the directives are matched, but not captured
+                wildcard_parts.append('(?:' + regex_part[1:])
+            else:
+                wildcard_parts.append(regex_part)
+
+        wildcard_parts.append('$')
+        patseg.wildcard_regex = re.compile(''.join(wildcard_parts))
+
+    if all(token.identifier in ['text', '%%', 'alternatives'] for token in tokens):
+        candidates = ['']  # type: List[str]
+        for token in tokens:
+            if token.identifier == 'alternatives':
+                options = token.content[1:-1].split(',')
+            elif token.identifier == '%%':
+                options = ['%']
+            else:
+                options = [token.content]
+
+            candidates = [candidate + option for candidate in candidates for option in options]
+            if len(candidates) > MAX_CANDIDATES:
+                break
+
+        if len(candidates) <= MAX_CANDIDATES:
+            patseg.candidates = sorted(set(candidates))
+
+    # The names matching the segment have a fixed width and sort chronologically if the segment contains only
+    # text and zero-padded directives given from the most to the least significant field.
+    ranks = []  # type: List[int]
+    order_preserving = True
+    for token in tokens:
+        if token.identifier in FIELD_RANKS:
+            if token.identifier not in ZERO_PADDED_DIRECTIVES or (ranks and FIELD_RANKS[token.identifier] < ranks[-1]):
+                order_preserving = False
+                break
+
+            ranks.append(FIELD_RANKS[token.identifier])
+
+        elif token.identifier not in ['text', '%%']:
+            order_preserving = False
+            break
+
+    patseg.order_preserving = order_preserving and len(ranks) > 0
     return patseg
 
 
@@ -218,6 +405,11 @@ def parse_pattern_segment(pattern_segment: str) -> PatternSegment:
     for line in token_lines:
         tokens.extend(line)
 
+    for token in tokens:
+        if token.identifier == 'alternatives' and '' in token.content[1:-1].split(','):
+            raise ValueError("Expected non-empty alternatives in the pattern segment {}, but got: {}".format(
+                pattern_segment, token.content))
+
     patseg = __tokens_as_fixed_text(tokens=tokens)
     if patseg is None:
         patseg = __tokens_as_pattern_segment(tokens=tokens)
@@ -426,6 +618,178 @@ class Match:
 EMPTY_MATCH = Match()
 
 
+def _match_as_list(match: Match) -> List[Optional[int]]:
+    """Convert the match to a JSON-serializable list of its fields."""
+    return [match.year, match.month, match.day, match.hour, match.minute, match.second, match.microsecond]
+
+
+def _match_from_list(fields: List[Optional[int]]) -> Match:
+    """Convert the list of fields back to a match."""
+    if len(fields) != 7:
+        raise ValueError("Expected 7 fields of a match, but got {}: {}".format(len(fields), fields))
+
+    return Match(*fields)
+
+
+def _match_span(match: Match) -> Optional[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Determine the time span covered by the match.
+
+    For example, a match with only year and month set covers the whole month.
+
+    :param match: to be analyzed
+    :return:
+        (inclusive start, exclusive end) of the span; None if the set fields do not form a contiguous sequence
+        starting with the year or if they do not represent a valid date/time
+    """
+    fields = _match_as_list(match)
+
+    last = -1
+    for i, value in enumerate(fields):
+        if value is None:
+            break
+
+        last = i
+
+    if last < 0 or any(value is not None for value in fields[last + 1:]):
+        return None
+
+    year, month, day, hour, minute, second, microsecond = fields
+    assert year is not None
+
+    try:
+        start = datetime.datetime(
+            year=year,
+            month=1 if month is None else month,
+            day=1 if day is None else day,
+            hour=0 if hour is None else hour,
+            minute=0 if minute is None else minute,
+            second=0 if second is None else second,
+            microsecond=0 if microsecond is None else microsecond)
+    except ValueError:
+        return None
+
+    try:
+        if last == 0:
+            end = datetime.datetime(year=year + 1, month=1, day=1)
+        elif last == 1:
+            end = start.replace(year=year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+        else:
+            end = start + [
+                datetime.timedelta(days=1),
+                datetime.timedelta(hours=1),
+                datetime.timedelta(minutes=1),
+                datetime.timedelta(seconds=1),
+                datetime.timedelta(microseconds=1)
+            ][last - 2]
+    except (ValueError, OverflowError):
+        end = datetime.datetime.max
+
+    return start, end
+
+
+def _datetime_fields(dtime: datetime.datetime) -> List[int]:
+    """List the fields of the date/time from the most to the least significant one."""
+    return [dtime.year, dtime.month, dtime.day, dtime.hour, dtime.minute, dtime.second, dtime.microsecond]
+
+
+def _truncate(dtime: datetime.datetime, rank: int) -> datetime.datetime:
+    """Reset all the fields of the date/time less significant than the given rank."""
+    if rank < 1:
+        dtime = dtime.replace(month=1)
+    if rank < 2:
+        dtime = dtime.replace(day=1)
+    if rank < 3:
+        dtime = dtime.replace(hour=0)
+    if rank < 4:
+        dtime = dtime.replace(minute=0)
+    if rank < 5:
+        dtime = dtime.replace(second=0)
+    if rank < 6:
+        dtime = dtime.replace(microsecond=0)
+
+    return dtime
+
+
+def _century_position(pattern_segment: PatternSegment, dtime: datetime.datetime) -> int:
+    """
+    Check whether the year of the date/time can be rendered by the directive '%y' of the pattern segment.
+
+    :param pattern_segment: to be rendered
+    :param dtime: date/time to be rendered
+    :return: -1 if the date/time precedes the century of '%y', 1 if it follows the century, 0 otherwise
+    """
+    if any(identifier == '%y' for identifier, _ in pattern_segment.tokens):
+        if dtime.year < 2000:
+            return -1
+
+        if dtime.year > 2099:
+            return 1
+
+    return 0
+
+
+def _render_segment(pattern_segment: PatternSegment, dtime: datetime.datetime) -> str:
+    """
+    Render the pattern segment consisting only of text and zero-padded directives.
+
+    :param pattern_segment: to be rendered
+    :param dtime: values of the directives
+    :return: rendered segment
+    """
+    parts = []  # type: List[str]
+    for identifier, content in pattern_segment.tokens:
+        if identifier == 'text':
+            parts.append(content)
+        elif identifier == '%%':
+            parts.append('%')
+        elif identifier == '%Y':
+            parts.append('{:04d}'.format(dtime.year))
+        elif identifier == '%y':
+            parts.append('{:02d}'.format(dtime.year % 100))
+        elif identifier == '%m':
+            parts.append('{:02d}'.format(dtime.month))
+        elif identifier == '%d':
+            parts.append('{:02d}'.format(dtime.day))
+        elif identifier == '%H':
+            parts.append('{:02d}'.format(dtime.hour))
+        elif identifier == '%M':
+            parts.append('{:02d}'.format(dtime.minute))
+        elif identifier == '%S':
+            parts.append('{:02d}'.format(dtime.second))
+        elif identifier == '%f':
+            parts.append('{:06d}'.format(dtime.microsecond))
+        else:
+            raise NotImplementedError("Unhandled token in an order-preserving pattern segment: {}".format(identifier))
+
+    return ''.join(parts)
+
+
+def _segment_ranks(pattern_segment: PatternSegment) -> List[int]:
+    """List the ranks of the fields set by the directives of the pattern segment in order of appearance."""
+    return [FIELD_RANKS[identifier] for identifier, _ in pattern_segment.tokens if identifier in FIELD_RANKS]
+
+
+def _check_range_fields(pattern: str, pattern_segments: List[PatternSegment]) -> int:
+    """
+    Check that the pattern determines a time span so that it can be used in range queries.
+
+    :param pattern: for error messages
+    :param pattern_segments: of the pattern
+    :return: rank of the least significant field set by the pattern
+    :raises: ValueError if the fields do not form a contiguous sequence starting with the year
+    """
+    ranks = set()  # type: Set[int]
+    for patseg in pattern_segments:
+        ranks.update(_segment_ranks(patseg))
+
+    if not ranks or ranks != set(range(max(ranks) + 1)):
+        raise ValueError("Expected the pattern to set the date/time fields starting with the year without gaps "
+                         "(e.g., year, month and day) for a range query, but got: {}".format(pattern))
+
+    return max(ranks)
+
+
 def match_segment(segment: str, pattern_segment: PatternSegment, match: Match = EMPTY_MATCH) -> Optional[Match]:
     """
     Perform a step of incremental matching.
@@ -552,18 +916,84 @@ def match_segment(segment: str, pattern_segment: PatternSegment, match: Match =
             raise NotImplementedError("Unhandled directive {!r} in pattern: {}".format(
                 directive, pattern_segment.regex.pattern))
 
-    if match1.year is not None and match1.month is not None and \
-            match1.year != match.year and match1.month != match.month:
-        _, days_in_month = calendar.monthrange(match1.year, match1.month)
+    # Check the calendar as soon as the month and the day are known so that the impossible dates are pruned early.
+    # If the year is not known yet, February 29 is allowed and the leap year is checked once the year is known.
+    if match1.month is not None and match1.day is not None and \
+            (match1.year != match.year or match1.month != match.month or match1.day != match.day):
+        _, days_in_month = calendar.monthrange(match1.year if match1.year is not None else 2000, match1.month)
 
-        assert match1.day is not None, \
-            'year and month of match1 are not None, but match1.day is unexpectedly None.'
         if match1.day > days_in_month:
             return None
 
     return match1
 
 
+def _match_segments(segments: List[str], pattern_segments: List[PatternSegment], match: Match) -> Optional[Match]:
+    """
+    Match the path segments against the pattern segments which may include recursive wildcards.
+
+    The recursive wildcards are backtracked. The fixed number of pattern segments following the last recursive
+    wildcard determines directly how many path segments the wildcard needs to consume.
+
+    :param segments: path segments
+    :param pattern_segments: pattern segments
+    :param match: what we matched so far
+    :return: the complete match, or None if the segments could not be matched
+    """
+    # the fixed tails do not need to be recomputed at every backtracking step
+    fixed_after = [0] * (len(pattern_segments) + 1)  # type: List[int]
+    recursive_after = [False] * (len(pattern_segments) + 1)  # type: List[bool]
+    for j in reversed(range(len(pattern_segments))):
+        fixed_after[j] = fixed_after[j + 1] + (0 if pattern_segments[j].recursive else 1)
+        recursive_after[j] = recursive_after[j + 1] or pattern_segments[j].recursive
+
+    failed = set()  # type: Set[Tuple[int, int, Tuple[Optional[int], ...]]]
+
+    def match_from(i: int, j: int, mtch: Match) -> Optional[Match]:
+        """Match the segments[i:] against the pattern_segments[j:]."""
+        # pylint: disable=too-many-return-statements
+        while j < len(pattern_segments) and not pattern_segments[j].recursive:
+            if i >= len(segments):
+                return None
+
+            maybe_mtch = match_segment(segment=segments[i], pattern_segment=pattern_segments[j], match=mtch)
+            if maybe_mtch is None:
+                return None
+
+            mtch = maybe_mtch
+            i += 1
+            j += 1
+
+        if j == len(pattern_segments):
+            return mtch if i == len(segments) else None
+
+        # collapse the consecutive recursive wildcards
+        while j < len(pattern_segments) and pattern_segments[j].recursive:
+            j += 1
+
+        if not recursive_after[j]:
+            # no further recursive wildcards, hence the number of consumed segments is determined.
+            consumed = len(segments) - i - fixed_after[j]
+            if consumed < 0:
+                return None
+
+            return match_from(i + consumed, j, mtch)
+
+        key = (i, j, tuple(_match_as_list(mtch)))
+        if key in failed:
+            return None
+
+        for k in range(i, len(segments) - fixed_after[j] + 1):
+            result = match_from(k, j, mtch)
+            if result is not None:
+                return result
+
+        failed.add(key)
+        return None
+
+    return match_from(0, 0, match)
+
+
 class Matcher:
     """Match the given path against a compiled pattern."""
 
@@ -571,8 +1001,20 @@ class Matcher:
         """Initialize by parsing the pattern."""
         self.pattern = pattern
         self.pattern_segments = parse_pattern(pattern)
+        self._recursive = any(patseg.recursive for patseg in self.pattern_segments)
+
+        # set if the lexicographical order of the matching paths equals their chronological order
+        self.order_preserving = all(patseg.order_preserving for patseg in self.pattern_segments)
+        ranks = [rank for patseg in self.pattern_segments for rank in _segment_ranks(patseg)]
+        if any(rank < previous for previous, rank in zip(ranks, ranks[1:])):
+            self.order_preserving = False
+
+        # str.format template of the pattern and the number of wildcards; compiled on the first use
+        self._template = None  # type: Optional[str]
+        self._wildcard_count = 0
+        self._format_ranks = sorted(set(ranks))
 
-    def match(self, path: Union[str, pathlib.Path]) -> Optional[Match]:
+    def match(self, path: Union[str, bytes, pathlib.Path]) -> Optional[Match]:
         """
         Try to match the given path.
 
@@ -584,32 +1026,37 @@ class Matcher:
             pth = path
         elif isinstance(path, pathlib.Path):
             pth = path.as_posix()
+        elif isinstance(path, bytes):
+            pth = os.fsdecode(path)
         else:
             raise ValueError("Unexpected path type: {}".format(type(path)))
 
         if pth == '':
-            raise ValueError("Can not match empty path: {}".format(path))
+            raise ValueError("Can not match empty path: {}".format(pth))
 
         if pth == '/':
-            raise ValueError("Can not match root: {}".format(path))
+            raise ValueError("Can not match root: {}".format(pth))
 
         if pth.endswith('/'):
-            raise ValueError("Unexpected trailing slash ('/'): {}".format(path))
+            raise ValueError("Unexpected trailing slash ('/'): {}".format(pth))
 
         if (pth.startswith('/') and not self.pattern.startswith('/')):
             raise ValueError("Can not match absolute path against relative path pattern {}: {}".format(
-                self.pattern, path))
+                self.pattern, pth))
 
         if (not pth.startswith('/') and self.pattern.startswith('/')):
             raise ValueError("Can not match relative path against absolute path pattern {}: {}".format(
-                self.pattern, path))
+                self.pattern, pth))
 
         segments = pth.split('/')  # type: List[str]
         segments = [segment for segment in segments if segment not in ('', '.')]
 
         for segment in segments:
             if segment == '..':
-                raise ValueError("Parent directory ('..') not allowed in a path: {}".format(path))
+                raise ValueError("Parent directory ('..') not allowed in a path: {}".format(pth))
+
+        if self._recursive:
+            return _match_segments(segments=segments, pattern_segments=self.pattern_segments, match=Match())
 
         if len(segments) != len(self.pattern_segments):
             return None
@@ -625,37 +1072,2969 @@ class Matcher:
 
         return mtch
 
+    def select_range(self, sorted_names: Sequence[str], start: Optional[datetime.datetime],
+                     end: Optional[datetime.datetime]) -> List[Tuple[Match, str]]:
+        """
+        Select the paths whose timestamps lie in the given range by bisecting the sorted paths.
+
+        The pattern needs to be order-preserving (see :py:attr:`Matcher.order_preserving`) so that only
+        O(log n) comparisons are necessary to find the range. The paths which do not match the pattern are ignored.
+
+        :param sorted_names: paths sorted in lexicographical order
+        :param start: inclusive start of the range; None if unbounded
+        :param end: exclusive end of the range; None if unbounded
+        :return: matches and paths in the range, in the order of the given paths
+        :raises: ValueError if the pattern is not order-preserving or does not determine a time span
+        """
+        if not self.order_preserving:
+            raise ValueError("The pattern is not order-preserving: {}".format(self.pattern))
+
+        rank = _check_range_fields(pattern=self.pattern, pattern_segments=self.pattern_segments)
+
+        def render(dtime: datetime.datetime) -> Optional[str]:
+            """Render the path of the date/time; None if it can not be represented by the pattern."""
+            if any(_century_position(patseg, dtime) != 0 for patseg in self.pattern_segments):
+                return None
+
+            pth = '/'.join(
+                patseg.text if patseg.text is not None else _render_segment(patseg, dtime)
+                for patseg in self.pattern_segments)
+
+            return '/' + pth if self.pattern.startswith('/') else pth
+
+        lo = 0
+        hi = len(sorted_names)
+
+        if start is not None:
+            lower = render(start)
+            if lower is not None:
+                lo = bisect.bisect_left(sorted_names, lower)
+            elif any(_century_position(patseg, start) > 0 for patseg in self.pattern_segments):
+                lo = hi
+
+        if end is not None:
+            upper = render(end)
+            if upper is not None:
+                if _truncate(end, rank) == end:
+                    hi = bisect.bisect_left(sorted_names, upper)
+                else:
+                    hi = bisect.bisect_right(sorted_names, upper)
+            elif any(_century_position(patseg, end) < 0 for patseg in self.pattern_segments):
+                hi = lo
+
+        result = []  # type: List[Tuple[Match, str]]
+        for i in range(lo, hi):
+            mtch = self.match(path=sorted_names[i])
+            if mtch is not None:
+                result.append((mtch, sorted_names[i]))
+
+        return result
+
+    def _compile_template(self) -> str:
+        """
+        Compile the pattern into a str.format template.
+
+        The positional arguments of the template are the fields of the date/time from the most to the least
+        significant one, followed by the two-digit year and the texts of the wildcards.
+
+        :return: compiled template
+        :raises: ValueError if the pattern contains a recursive wildcard
+        """
+        if self._recursive:
+            raise ValueError("Can not format a pattern with a recursive wildcard ('**'): {}".format(self.pattern))
+
+        wildcard_count = 0
+        segment_templates = []  # type: List[str]
+        for patseg in self.pattern_segments:
+            parts = []  # type: List[str]
+            for identifier, content in patseg.tokens:
+                if identifier == 'text':
+                    parts.append(content.replace('{', '{{').replace('}', '}}'))
+                elif identifier == '%%':
+                    parts.append('%')
+                elif identifier in WILDCARD_TOKENS:
+                    parts.append('{' + str(FORMAT_FIELD_COUNT + wildcard_count) + '}')
+                    wildcard_count += 1
+                else:
+                    parts.append(FORMAT_FIELDS[identifier])
+
+            segment_templates.append(''.join(parts))
+
+        template = '/'.join(segment_templates)
+        if self.pattern.startswith('/'):
+            template = '/' + template
+
+        self._wildcard_count = wildcard_count
+        return template
+
+    def format(self, match_or_datetime: Union[Match, datetime.datetime], wildcards: Sequence[str] = ()) -> str:
+        """
+        Render the path given the date/time values, the inverse of :py:meth:`match`.
+
+        The pattern is compiled into a template on the first call so that the subsequent calls are cheap.
+
+        :param match_or_datetime: values of the directives
+        :param wildcards: texts substituted for the wildcards ('*' and '?') in order of appearance
+        :return: rendered path
+        :raises:
+            ValueError if a field required by the pattern is not set, the number of wildcards differs or
+            the year can not be rendered by '%y'
+        """
+        if self._template is None:
+            self._template = self._compile_template()
+
+        if len(wildcards) != self._wildcard_count:
+            raise ValueError("Expected {} wildcard text(s) for the pattern {}, but got: {}".format(
+                self._wildcard_count, self.pattern, len(wildcards)))
+
+        if isinstance(match_or_datetime, datetime.datetime):
+            fields = list(_datetime_fields(match_or_datetime))  # type: List[Optional[int]]
+        else:
+            fields = _match_as_list(match_or_datetime)
+
+            missing = [FIELD_NAMES[rank] for rank in self._format_ranks if fields[rank] is None]
+            if missing:
+                raise ValueError("Expected the fields required by the pattern {} to be set, but got unset: {}".format(
+                    self.pattern, ', '.join(missing)))
+
+        year = fields[0]
+        if year is not None:
+            year_start = datetime.datetime(year, 1, 1)
+            if any(_century_position(patseg, year_start) != 0 for patseg in self.pattern_segments):
+                raise ValueError("Expected the year in [2000, 2099] to render '%y' of the pattern {}, "
+                                 "but got: {}".format(self.pattern, year))
+
+        return self._template.format(*fields, None if year is None else year % 100, *wildcards)
 
-def walk(pattern: str) -> Iterable[Tuple[Match, pathlib.Path]]:
+    def explain(self, sample_size: int = 0, backend: Optional['Backend'] = None) -> str:
+        """
+        Explain how a walk of the pattern is going to be executed.
+
+        :param sample_size: number of directories sampled per level to estimate the fan-out; 0 disables the sampling
+        :param backend: lists the sampled directories; if not set, the local file system is listed
+        :return: human-readable report
+        """
+        return str(plan(pattern=self.pattern, sample_size=sample_size, backend=backend))
+
+
+def _shard_of(relative_path: str, shard_count: int) -> int:
     """
-    Walk the pattern on the file system and return all the matching files with their parsed timestamps.
+    Compute deterministically the shard of a path relative to the fixed prefix of the walk.
 
-    :param pattern: that each file should match.
-    :return: matched files and extracted timestamps
+    :param relative_path: path relative to the fixed prefix
+    :param shard_count: total number of shards
+    :return: shard index of the path
+    """
+    return zlib.crc32(relative_path.encode('utf-8', 'surrogateescape')) % shard_count
+
+
+def _join(parent: str, name: str) -> str:
     """
-    prefix, initial_patsegs = parse_pattern_as_prefix_segments(pattern=pattern)
+    Join the name of a directory entry to the path of its parent directory.
 
-    if len(initial_patsegs) > 0:
-        stack = [(pathlib.Path(prefix), initial_patsegs, Match())]
+    :param parent: path to the parent directory; empty string denotes the current directory
+    :param name: of the entry
+    :return: path to the entry
+    """
+    if parent == '':
+        return name
 
-        while stack:
-            path, patsegs, mtch = stack.pop()
+    if parent.endswith('/'):
+        return parent + name
 
-            if len(patsegs) == 0:
-                raise AssertionError("Unexpected code path: path: {}, patsegs: {}, mtch: {}, stack: {}".format(
-                    path, patsegs, mtch, stack))
+    return parent + '/' + name
 
-            for subpth in path.iterdir():
-                subpth_mtch = match_segment(segment=subpth.name, pattern_segment=patsegs[0], match=mtch)
-                if subpth_mtch is None:
-                    continue
 
-                if len(patsegs) == 1:
-                    # recursion ends here.
-                    yield subpth_mtch, subpth
+def _relative(prefix: str, path: str) -> str:
+    """
+    Make the path relative to the fixed prefix of a walk.
+
+    :param prefix: fixed prefix of the walk
+    :param path: below the prefix
+    :return: relative path
+    """
+    if prefix == '':
+        return path
+
+    if prefix.endswith('/'):
+        return path[len(prefix):]
+
+    return path[len(prefix) + 1:]
+
+
+class Cursor:
+    """
+    Represent the position of a walk so that it can be resumed later.
+
+    The cursor captures the depth-first stack of the walk as pending directories together with the directory being
+    currently listed. It can be serialized to JSON and restored, *e.g.*, after a restart of the process.
+    """
+
+    def __init__(self,
+                 pattern: str,
+                 stack: List[Tuple[str, int, Match]],
+                 current: Optional[List[Tuple[str, int, Match]]] = None,
+                 after: Optional[str] = None) -> None:
+        """
+        Initialize with the given values.
+
+        :param pattern: of the walk
+        :param stack: pending directories as (path, index of the pattern segment below the prefix, match so far)
+        :param current:
+            the directory being currently listed, if any, as the frames of the stack sharing its path
+            (a directory below a recursive wildcard is matched in several ways, but listed only once)
+        :param after:
+            name of the last entry yielded from the current directory;
+            None if the sub-directories of the current directory have not been put on the stack yet.
+        """
+        self.pattern = pattern
+        self.stack = stack
+        self.current = current
+        self.after = after
+
+    def done(self) -> bool:
+        """Check whether there is nothing left to walk."""
+        return len(self.stack) == 0 and self.current is None
+
+    def to_json(self) -> str:
+        """Serialize the cursor to a JSON string."""
+        return json.dumps({
+            'pattern': self.pattern,
+            'stack': [[path, level, _match_as_list(match)] for path, level, match in self.stack],
+            'current': None if self.current is None else
+            [[path, level, _match_as_list(match)] for path, level, match in self.current],
+            'after': self.after
+        })
+
+    @staticmethod
+    def from_json(text: str) -> 'Cursor':
+        """
+        Parse the cursor from a JSON string.
+
+        :param text: as produced by :py:meth:`Cursor.to_json`
+        :return: parsed cursor
+        :raises: ValueError if the text is not a valid serialization of a cursor
+        """
+        try:
+            obj = json.loads(text)
+            current = obj['current']
+
+            return Cursor(
+                pattern=obj['pattern'],
+                stack=[(path, level, _match_from_list(fields)) for path, level, fields in obj['stack']],
+                current=None if current is None else
+                [(path, level, _match_from_list(fields)) for path, level, fields in current],
+                after=obj['after'])
+        except (KeyError, TypeError, IndexError) as err:
+            raise ValueError("Invalid cursor: {}".format(err)) from err
+
+    def __repr__(self) -> str:
+        """Represent the cursor succinctly, but not ``eval``-able."""
+        return 'Cursor(pattern={!r}, stack={} item(s), current={!r}, after={!r})'.format(
+            self.pattern, len(self.stack), None if self.current is None else self.current[0][0], self.after)
+
+
+class FileStat:
+    """Represent the metadata of a file."""
+
+    def __init__(self, size: int, mtime: float, inode: int) -> None:
+        """
+        Initialize with the given values.
+
+        :param size: in bytes
+        :param mtime: time of the last modification in seconds since epoch
+        :param inode: inode number (or its equivalent on the given storage)
+        """
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+
+    def __repr__(self) -> str:
+        """Represent the metadata succinctly, but not ``eval``-able."""
+        return 'FileStat(size={}, mtime={}, inode={})'.format(self.size, self.mtime, self.inode)
+
+
+class Entry:
+    """Represent an entry of a directory listing."""
+
+    def __init__(self,
+                 name: str,
+                 is_dir: Optional[bool] = None,
+                 handle: Any = None,
+                 is_symlink: Optional[bool] = False) -> None:
+        """
+        Initialize with the given values.
+
+        :param name: of the entry
+        :param is_dir:
+            True if the entry is a directory (or a link to a directory);
+            None if it is resolved lazily through ``is_dir()`` of the handle, only if the walk needs it
+        :param handle:
+            backend-specific handle of the entry (*e.g.*, ``os.DirEntry``) so that the metadata can be retrieved
+            without another lookup
+        :param is_symlink:
+            True if the entry is a symbolic link;
+            None if it is resolved lazily through ``is_symlink()`` of the handle, only if the walk needs it
+        """
+        self.name = name
+        self.handle = handle
+        self._is_dir = is_dir
+        self._is_symlink = is_symlink
+
+    @property
+    def is_dir(self) -> bool:
+        """Check whether the entry is a directory (or a link to a directory); an inaccessible entry is not."""
+        if self._is_dir is None:
+            try:
+                self._is_dir = bool(self.handle.is_dir())
+            except OSError:
+                self._is_dir = False
+
+        return self._is_dir
+
+    @property
+    def is_symlink(self) -> bool:
+        """Check whether the entry is a symbolic link; an inaccessible entry is not."""
+        if self._is_symlink is None:
+            try:
+                self._is_symlink = bool(self.handle.is_symlink())
+            except OSError:
+                self._is_symlink = False
+
+        return self._is_symlink
+
+    def __repr__(self) -> str:
+        """Represent the entry succinctly, but not ``eval``-able."""
+        return 'Entry(name={!r}, is_dir={})'.format(self.name, self.is_dir)
+
+
+class Backend(abc.ABC):
+    """
+    Define how the directories are listed during a walk.
+
+    The paths are given as POSIX strings. The empty string denotes the current directory.
+    """
+
+    @abc.abstractmethod
+    def list_directory(self, path: str) -> List[Entry]:
+        """
+        List the entries of the directory.
+
+        :param path: to the directory
+        :return: entries of the directory in arbitrary order
+        :raises: OSError if the directory can not be listed
+        """
+        raise NotImplementedError()
+
+    def list_pages(self, path: str) -> Iterator[List[Entry]]:
+        """
+        List the entries of the directory in pages.
+
+        Override this method if the underlying storage is naturally paged (*e.g.*, an object store).
+
+        :param path: to the directory
+        :return: pages of entries in arbitrary order
+        :raises: OSError if the directory can not be listed
+        """
+        yield self.list_directory(path=path)
+
+    def lookup(self, path: str, names: List[str]) -> List[Entry]:
+        """
+        Look up the given entries of the directory.
+
+        Override this method if the entries can be looked up more cheaply than listing the whole directory
+        (*e.g.*, by stat'ing them).
+
+        :param path: to the directory
+        :param names: of the entries
+        :return: entries which exist, in arbitrary order
+        :raises: OSError if the directory can not be accessed
+        """
+        name_set = set(names)
+        return [entry for entry in self.list_directory(path=path) if entry.name in name_set]
+
+    def stat_entries(self, path: str, entries: List[Entry]) -> List[Union[FileStat, OSError]]:
+        """
+        Retrieve the metadata of the directory entries in a batch.
+
+        :param path: to the directory
+        :param entries: as listed by the backend
+        :return: metadata of each entry, or the error if the metadata could not be retrieved
+        """
+        raise NotImplementedError("The backend {} does not provide the metadata of the entries.".format(
+            type(self).__name__))
+
+    def directory_mtime(self, path: str) -> Optional[float]:
+        """
+        Retrieve the time of the last modification of the directory.
+
+        Override this method if the underlying storage tracks the changes of the directories so that the cached
+        listings can be validated (see :py:class:`ListingCache`).
+
+        :param path: to the directory
+        :return: modification time in seconds since epoch; None if unknown
+        :raises: OSError if the directory can not be accessed
+        """
+        # pylint: disable=no-self-use,unused-argument
+        return None
+
+
+class LocalBackend(Backend):
+    """List directories of the local file system."""
+
+    def __init__(self, page_size: int = 1000) -> None:
+        """
+        Initialize with the given values.
+
+        :param page_size: number of entries in a page of a paged listing
+        """
+        if page_size < 1:
+            raise ValueError("Expected page_size >= 1, but got: {}".format(page_size))
+
+        self.page_size = page_size
+
+    def list_directory(self, path: str) -> List[Entry]:
+        """List the entries of the directory; see :py:meth:`Backend.list_directory`."""
+        entries = []  # type: List[Entry]
+        for page in self.list_pages(path=path):
+            entries.extend(page)
+
+        return entries
+
+    def list_pages(self, path: str) -> Iterator[List[Entry]]:
+        """List the entries of the directory in pages; see :py:meth:`Backend.list_pages`."""
+        page = []  # type: List[Entry]
+        scandir_it = os.scandir(path if path != '' else '.')
+        try:
+            for dir_entry in scandir_it:
+                # the type is resolved lazily since it might require a stat on some file systems
+                page.append(Entry(name=dir_entry.name, handle=dir_entry, is_symlink=None))
+
+                if len(page) == self.page_size:
+                    yield page
+                    page = []
+        finally:
+            # the iterator can be closed explicitly (and used as a context manager) only as of Python 3.6
+            close = getattr(scandir_it, 'close', None)
+            if close is not None:
+                close()
+
+        if page:
+            yield page
+
+    def lookup(self, path: str, names: List[str]) -> List[Entry]:
+        """Stat the given entries of the directory; see :py:meth:`Backend.lookup`."""
+        entries = []  # type: List[Entry]
+        for name in names:
+            pth = _join(path if path != '' else '.', name)
+            try:
+                stat_result = os.lstat(pth)
+                is_symlink = S_ISLNK(stat_result.st_mode)
+                if is_symlink:
+                    stat_result = os.stat(pth)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            entries.append(
+                Entry(name=name, is_dir=S_ISDIR(stat_result.st_mode), handle=stat_result, is_symlink=is_symlink))
+
+        return entries
+
+    def stat_entries(self, path: str, entries: List[Entry]) -> List[Union[FileStat, OSError]]:
+        """
+        Retrieve the metadata of the directory entries; see :py:meth:`Backend.stat_entries`.
+
+        The metadata cached by ``os.scandir`` or retrieved by :py:meth:`lookup` is re-used so that no entry is
+        stat'ed twice.
+        """
+        result = []  # type: List[Union[FileStat, OSError]]
+        for entry in entries:
+            try:
+                if isinstance(entry.handle, os.stat_result):
+                    stat_result = entry.handle
+                elif hasattr(entry.handle, 'stat'):
+                    # os.DirEntry is not exposed in Python 3.5 so the entries of os.scandir can not be checked directly
+                    stat_result = entry.handle.stat()
                 else:
-                    # skip non-directories, since recursion needs to descend.
-                    if not subpth.is_dir():
-                        continue
+                    stat_result = os.stat(_join(path if path != '' else '.', entry.name))
+
+                result.append(FileStat(size=stat_result.st_size, mtime=stat_result.st_mtime, inode=stat_result.st_ino))
+            except OSError as err:
+                result.append(err)
+
+        return result
+
+    def directory_mtime(self, path: str) -> Optional[float]:
+        """Retrieve the modification time of the directory; see :py:meth:`Backend.directory_mtime`."""
+        return os.stat(path if path != '' else '.').st_mtime
+
+
+def _normalize(path: str) -> str:
+    """
+    Normalize the path by removing the empty and current-directory segments.
+
+    :param path: to be normalized
+    :return: normalized path; the empty string denotes the current directory
+    """
+    parts = [part for part in path.split('/') if part not in ('', '.')]
+    if path.startswith('/'):
+        return '/' + '/'.join(parts)
+
+    return '/'.join(parts)
+
+
+def _parent_and_name(path: str) -> Tuple[str, str]:
+    """
+    Split the normalized path into the parent directory and the name of the entry.
+
+    :param path: normalized path
+    :return: parent directory, name
+    """
+    parent, _, name = path.rpartition('/')
+    if parent == '' and path.startswith('/'):
+        parent = '/'
+
+    return parent, name
+
+
+class MemoryBackend(Backend):
+    """Hold a directory tree in memory, *e.g.*, for testing or to walk a snapshot manifest."""
+
+    def __init__(self, files: Optional[Iterable[str]] = None) -> None:
+        """
+        Initialize with the given files.
+
+        :param files: paths to the files; the parent directories are created implicitly
+        """
+        # directory -> entry name -> True if the entry is a directory
+        self._tree = {'': {}, '/': {}}  # type: Dict[str, Dict[str, bool]]
+
+        # file -> metadata
+        self._stats = dict()  # type: Dict[str, FileStat]
+
+        if files is not None:
+            for pth in files:
+                self.add_file(pth)
+
+    def add_directory(self, path: str) -> None:
+        """
+        Add the directory and its parent directories to the tree.
+
+        :param path: to the directory
+        :raises: NotADirectoryError if the path or one of its parents has been already added as a file
+        """
+        pth = _normalize(path)
+        if pth in self._tree:
+            return
+
+        parent, name = _parent_and_name(pth)
+        self.add_directory(parent)
+
+        if self._tree[parent].get(name) is False:
+            raise NotADirectoryError("The path has been already added as a file: {}".format(pth))
+
+        self._tree[parent][name] = True
+        self._tree[pth] = dict()
+
+    def add_file(self, path: str, stat: Optional[FileStat] = None) -> None:
+        """
+        Add the file and its parent directories to the tree.
+
+        :param path: to the file
+        :param stat: metadata of the file; if not set, an empty file is assumed
+        :raises: IsADirectoryError if the path has been already added as a directory
+        """
+        pth = _normalize(path)
+        if pth in self._tree:
+            raise IsADirectoryError("The path has been already added as a directory: {}".format(pth))
+
+        parent, name = _parent_and_name(pth)
+        self.add_directory(parent)
+        self._tree[parent][name] = False
+        self._stats[pth] = stat if stat is not None else FileStat(size=0, mtime=0.0, inode=len(self._stats) + 1)
+
+    def list_directory(self, path: str) -> List[Entry]:
+        """List the entries of the directory; see :py:meth:`Backend.list_directory`."""
+        pth = _normalize(path)
+        if pth not in self._tree:
+            parent, name = _parent_and_name(pth)
+            if self._tree.get(parent, dict()).get(name) is False:
+                raise NotADirectoryError("Not a directory: {}".format(pth))
+
+            raise FileNotFoundError("No such directory: {}".format(pth))
+
+        return [Entry(name=name, is_dir=is_dir) for name, is_dir in self._tree[pth].items()]
+
+    def lookup(self, path: str, names: List[str]) -> List[Entry]:
+        """Look up the given entries of the directory; see :py:meth:`Backend.lookup`."""
+        children = self._tree.get(_normalize(path), dict())
+        return [Entry(name=name, is_dir=children[name]) for name in names if name in children]
+
+    def stat_entries(self, path: str, entries: List[Entry]) -> List[Union[FileStat, OSError]]:
+        """Retrieve the metadata of the directory entries; see :py:meth:`Backend.stat_entries`."""
+        result = []  # type: List[Union[FileStat, OSError]]
+        for entry in entries:
+            pth = _join(_normalize(path), entry.name)
+            if pth in self._stats:
+                result.append(self._stats[pth])
+            elif pth in self._tree:
+                result.append(FileStat(size=0, mtime=0.0, inode=0))
+            else:
+                result.append(FileNotFoundError("No such file: {}".format(pth)))
+
+        return result
+
+
+class ArchiveBackend(Backend):
+    """
+    List the members of a tar or zip archive as a directory tree without extracting the archive.
+
+    The member index is read once on initialization. The members can be opened individually with
+    :py:meth:`ArchiveBackend.open`.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path]) -> None:
+        """
+        Read the member index of the archive.
+
+        :param path: to the archive
+        :raises: ValueError if the file is neither a tar nor a zip archive
+        """
+        self.path = str(path)
+
+        self._memory = MemoryBackend()
+
+        # normalized member path -> zipfile.ZipInfo or tarfile.TarInfo
+        self._members = dict()  # type: Dict[str, Any]
+
+        self._lock = threading.Lock()
+        self._zip = None  # type: Optional[zipfile.ZipFile]
+        self._tar = None  # type: Optional[tarfile.TarFile]
+
+        if zipfile.is_zipfile(self.path):
+            self._zip = zipfile.ZipFile(self.path)
+            for i, zipinfo in enumerate(self._zip.infolist()):
+                if zipinfo.filename.endswith('/'):
+                    self._memory.add_directory(zipinfo.filename)
+                else:
+                    self._add_member(
+                        name=zipinfo.filename,
+                        member=zipinfo,
+                        stat=FileStat(
+                            size=zipinfo.file_size, mtime=time.mktime(zipinfo.date_time + (0, 0, -1)), inode=i + 1))
+        else:
+            try:
+                self._tar = tarfile.open(self.path, mode='r:*')
+            except tarfile.ReadError as err:
+                raise ValueError("Expected a tar or a zip archive: {}".format(self.path)) from err
+
+            # iterating the tar file reads only the member headers.
+            for i, tarinfo in enumerate(self._tar):
+                if tarinfo.isdir():
+                    self._memory.add_directory(tarinfo.name)
+                elif tarinfo.isfile():
+                    self._add_member(
+                        name=tarinfo.name,
+                        member=tarinfo,
+                        stat=FileStat(size=tarinfo.size, mtime=float(tarinfo.mtime), inode=i + 1))
+
+    def _add_member(self, name: str, member: Any, stat: FileStat) -> None:
+        """Add the file member to the index."""
+        pth = _normalize(name)
+        self._memory.add_file(pth, stat=stat)
+        self._members[pth] = member
+
+    def list_directory(self, path: str) -> List[Entry]:
+        """List the entries of the directory; see :py:meth:`Backend.list_directory`."""
+        return self._memory.list_directory(path=path)
+
+    def lookup(self, path: str, names: List[str]) -> List[Entry]:
+        """Look up the given entries of the directory; see :py:meth:`Backend.lookup`."""
+        return self._memory.lookup(path=path, names=names)
+
+    def stat_entries(self, path: str, entries: List[Entry]) -> List[Union[FileStat, OSError]]:
+        """Retrieve the metadata of the directory entries; see :py:meth:`Backend.stat_entries`."""
+        return self._memory.stat_entries(path=path, entries=entries)
+
+    def open(self, path: str) -> IO[bytes]:
+        """
+        Open the member of the archive for reading.
+
+        The archive is re-opened if it has been closed in the meantime.
+
+        :param path: to the member
+        :return: file object of the member
+        :raises: FileNotFoundError if there is no such file member in the archive
+        """
+        pth = _normalize(path)
+        if pth not in self._members:
+            raise FileNotFoundError("No such file member in the archive {}: {}".format(self.path, pth))
+
+        member = self._members[pth]
+
+        with self._lock:
+            if isinstance(member, zipfile.ZipInfo):
+                if self._zip is None:
+                    self._zip = zipfile.ZipFile(self.path)
+
+                return self._zip.open(member)
+
+            if self._tar is None:
+                self._tar = tarfile.open(self.path, mode='r:*')
+
+            fid = self._tar.extractfile(member)
+            assert fid is not None, "Expected a file object for a file member: {}".format(pth)
+            return fid
+
+    def close(self) -> None:
+        """Close the archive; the member index is kept."""
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+                self._zip = None
+
+            if self._tar is not None:
+                self._tar.close()
+                self._tar = None
+
+    def __enter__(self) -> 'ArchiveBackend':
+        """Return the backend itself."""
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        """Close the archive."""
+        self.close()
+
+
+ON_ERROR_POLICIES = ('raise', 'skip', 'collect')
+
+
+class _EntryType:
+    """Resolve the type of a wrapped entry without exposing the metadata of its handle."""
+
+    def __init__(self, entry: Entry) -> None:
+        """Initialize with the given values."""
+        self.entry = entry
+
+    def is_dir(self) -> bool:
+        """Check whether the wrapped entry is a directory (or a link to a directory)."""
+        return self.entry.is_dir
+
+    def is_symlink(self) -> bool:
+        """Check whether the wrapped entry is a symbolic link."""
+        return self.entry.is_symlink
+
+
+class ListingCache(Backend):
+    """
+    Cache the directory listings of another backend so that they can be shared across the walks.
+
+    The cache is thread-safe. Pass it as the backend to :py:func:`walk` or to any other function accepting a backend.
+    The listings expire after the time-to-live and the least recently used listings are evicted once the cache is
+    full. If the listings are validated by the modification time, a cached listing is re-used only if the directory
+    has not been modified since, at the cost of retrieving the modification time on each lookup.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 backend: Optional[Backend] = None,
+                 max_entries: int = 1024,
+                 ttl: Optional[float] = 60.0,
+                 validate_mtime: bool = False) -> None:
+        """
+        Initialize with the given values.
+
+        :param backend: whose listings are cached; if not set, the local file system is listed
+        :param max_entries: maximum number of cached directory listings
+        :param ttl: time-to-live of a listing in seconds; None if the listings do not expire
+        :param validate_mtime:
+            if set, a cached listing is discarded if the modification time of the directory changed
+            (see :py:meth:`Backend.directory_mtime`)
+        """
+        if max_entries < 1:
+            raise ValueError("Expected max_entries >= 1, but got: {}".format(max_entries))
+
+        if ttl is not None and ttl <= 0:
+            raise ValueError("Expected ttl > 0, but got: {}".format(ttl))
+
+        self.backend = backend if backend is not None else LocalBackend()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.validate_mtime = validate_mtime
+
+        # number of lookups served from the cache and from the backend, respectively
+        self.hits = 0
+        self.misses = 0
+
+        # path -> (time of the listing, modification time of the directory, entries), least recently used first
+        self._listings = collections.OrderedDict(
+        )  # type: collections.OrderedDict[str, Tuple[float, Optional[float], List[Entry]]]
+        self._lock = threading.Lock()
+
+    def _cached(self, path: str, mtime: Optional[float], now: float) -> Optional[List[Entry]]:
+        """
+        Retrieve the cached listing if it is still valid; the invalid listing is discarded.
+
+        :param path: to the directory
+        :param mtime: current modification time of the directory, if validated
+        :param now: current monotonic time
+        :return: cached entries, or None if there is no valid listing in the cache
+        """
+        with self._lock:
+            cached = self._listings.get(path, None)
+            if cached is not None:
+                listed_at, listed_mtime, entries = cached
+                if (self.ttl is None or now - listed_at < self.ttl) and \
+                        (not self.validate_mtime or (mtime is not None and mtime == listed_mtime)):
+                    self._listings.move_to_end(path)
+                    self.hits += 1
+                    return list(entries)
+
+                del self._listings[path]
+
+            self.misses += 1
+            return None
+
+    def list_directory(self, path: str) -> List[Entry]:
+        """List the entries of the directory, re-using a cached listing if possible."""
+        mtime = self.backend.directory_mtime(path=path) if self.validate_mtime else None
+        now = time.monotonic()
+
+        cached = self._cached(path=path, mtime=mtime, now=now)
+        if cached is not None:
+            return cached
+
+        # The handles are wrapped since they might carry metadata cached at the time of the listing
+        # (e.g., os.DirEntry). The types are still resolved lazily, at most once per cached entry.
+        entries = [
+            Entry(name=entry.name, handle=_EntryType(entry=entry), is_symlink=None)
+            for entry in self.backend.list_directory(path=path)
+        ]
+
+        with self._lock:
+            self._listings[path] = (now, mtime, entries)
+            self._listings.move_to_end(path)
+
+            while len(self._listings) > self.max_entries:
+                self._listings.popitem(last=False)
+
+        return list(entries)
+
+    def lookup(self, path: str, names: List[str]) -> List[Entry]:
+        """
+        Look up the given entries of the directory; see :py:meth:`Backend.lookup`.
+
+        A cached listing is re-used if possible. Otherwise, the entries are looked up through the backend
+        and the result is not cached since it is not a complete listing.
+        """
+        mtime = self.backend.directory_mtime(path=path) if self.validate_mtime else None
+
+        cached = self._cached(path=path, mtime=mtime, now=time.monotonic())
+        if cached is not None:
+            name_set = set(names)
+            return [entry for entry in cached if entry.name in name_set]
+
+        return self.backend.lookup(path=path, names=names)
+
+    def stat_entries(self, path: str, entries: List[Entry]) -> List[Union[FileStat, OSError]]:
+        """Retrieve the metadata of the entries from the backend; see :py:meth:`Backend.stat_entries`."""
+        return self.backend.stat_entries(path=path, entries=entries)
+
+    def directory_mtime(self, path: str) -> Optional[float]:
+        """Retrieve the modification time from the backend; see :py:meth:`Backend.directory_mtime`."""
+        return self.backend.directory_mtime(path=path)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """
+        Discard the cached listings.
+
+        :param path: to the directory whose listing is discarded; if not set, all the listings are discarded
+        """
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(path, None)
+
+    def __len__(self) -> int:
+        """Return the number of cached listings."""
+        with self._lock:
+            return len(self._listings)
+
+
+# reference of the timestamps stored in a MatchSet
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# values of the fields which are not set in a match when the match is stored in a MatchSet;
+# the year is a leap year so that February 29 can be represented.
+_MATCH_SET_DEFAULTS = [2000, 1, 1, 0, 0, 0, 0]
+
+
+class MatchSet:
+    """
+    Hold a large number of matches and paths compactly.
+
+    The timestamps are stored as microseconds since :py:data:`EPOCH` in an array together with a bit mask of
+    the fields set in each match. The paths are split into the parent directories, each stored only once, and
+    the names of the entries. The matches and the paths are re-constructed lazily on access.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, path_type: type = pathlib.Path) -> None:
+        """
+        Initialize an empty set.
+
+        :param path_type: type of the paths on access: ``pathlib.Path``, ``str`` or ``bytes``
+        """
+        if path_type not in (str, bytes, pathlib.Path):
+            raise ValueError("Expected path_type to be str, bytes or pathlib.Path, but got: {}".format(path_type))
+
+        self.path_type = path_type
+
+        self._micros = array.array('q')
+        self._masks = array.array('B')
+        self._parents = array.array('L')
+        self._names = []  # type: List[str]
+
+        # table of the parent directories and the index of each directory in the table
+        self._directories = []  # type: List[str]
+        self._directory_index = dict()  # type: Dict[str, int]
+
+        # set if the entries are sorted by their timestamps
+        self._sorted = True
+
+    def add(self, match: Match, path: Union[str, pathlib.Path]) -> None:
+        """
+        Add the match and its path to the set.
+
+        :param match: of the path
+        :param path: matching the pattern
+        :raises: ValueError if the match does not represent a valid date/time
+        """
+        fields = _match_as_list(match)
+
+        mask = 0
+        values = []  # type: List[int]
+        for i, (value, default) in enumerate(zip(fields, _MATCH_SET_DEFAULTS)):
+            if value is not None:
+                mask |= 1 << i
+                values.append(value)
+            else:
+                values.append(default)
+
+        dtime = datetime.datetime(values[0], values[1], values[2], values[3], values[4], values[5], values[6])
+        micros = (dtime - EPOCH) // datetime.timedelta(microseconds=1)
+
+        pth = path if isinstance(path, str) else path.as_posix()
+        parent, name = _parent_and_name(pth)
+
+        index = self._directory_index.get(parent, None)
+        if index is None:
+            index = len(self._directories)
+            self._directories.append(parent)
+            self._directory_index[parent] = index
+
+        if self._sorted and self._micros and micros < self._micros[-1]:
+            self._sorted = False
+
+        self._micros.append(micros)
+        self._masks.append(mask)
+        self._parents.append(index)
+        self._names.append(name)
+
+    def __len__(self) -> int:
+        """Return the number of the matches in the set."""
+        return len(self._micros)
+
+    def timestamp(self, index: int) -> datetime.datetime:
+        """
+        Retrieve the timestamp of the match at the index.
+
+        :param index: of the match
+        :return: date/time of the match where the fields not set default to the start of the span
+        """
+        return EPOCH + datetime.timedelta(microseconds=self._micros[index])
+
+    def match(self, index: int) -> Match:
+        """Re-construct the match at the index."""
+        mask = self._masks[index]
+        fields = _datetime_fields(self.timestamp(index))
+        return _match_from_list([value if mask & (1 << i) else None for i, value in enumerate(fields)])
+
+    def path(self, index: int) -> Any:
+        """Re-construct the path at the index as :py:attr:`MatchSet.path_type`."""
+        pth = _join(self._directories[self._parents[index]], self._names[index])
+
+        if self.path_type is str:
+            return pth
+
+        if self.path_type is bytes:
+            return os.fsencode(pth)
+
+        return pathlib.Path(pth)
+
+    def __getitem__(self, index: int) -> Tuple[Match, Any]:
+        """Re-construct the match and the path at the index."""
+        return self.match(index), self.path(index)
+
+    def __iter__(self) -> Iterator[Tuple[Match, Any]]:
+        """Iterate lazily over the matches and the paths."""
+        for i in range(len(self._micros)):
+            yield self.match(i), self.path(i)
+
+    def sort(self) -> None:
+        """Sort the entries in place by their timestamps and then by their paths."""
+        if self._sorted:
+            return
+
+        order = sorted(
+            range(len(self._micros)),
+            key=lambda i: (self._micros[i], self._directories[self._parents[i]], self._names[i]))
+
+        self._micros = array.array('q', (self._micros[i] for i in order))
+        self._masks = array.array('B', (self._masks[i] for i in order))
+        self._parents = array.array('L', (self._parents[i] for i in order))
+        self._names = [self._names[i] for i in order]
+        self._sorted = True
+
+    def select(self, start: Optional[datetime.datetime], end: Optional[datetime.datetime]) -> 'MatchSet':
+        """
+        Select the entries whose timestamps lie in the range by bisecting the sorted timestamps.
+
+        :param start: inclusive start of the range; None if unbounded
+        :param end: exclusive end of the range; None if unbounded
+        :return: new set with the selected entries; the table of the parent directories is shared
+        :raises: ValueError if the set is not sorted
+        """
+        if not self._sorted:
+            raise ValueError("Expected the match set to be sorted; call sort() first.")
+
+        lo = 0
+        hi = len(self._micros)
+
+        one_micro = datetime.timedelta(microseconds=1)
+        if start is not None:
+            lo = bisect.bisect_left(self._micros, (start - EPOCH) // one_micro)
+
+        if end is not None:
+            hi = max(lo, bisect.bisect_left(self._micros, (end - EPOCH) // one_micro))
+
+        result = MatchSet(path_type=self.path_type)
+        result._micros = self._micros[lo:hi]  # pylint: disable=protected-access
+        result._masks = self._masks[lo:hi]  # pylint: disable=protected-access
+        result._parents = self._parents[lo:hi]  # pylint: disable=protected-access
+        result._names = self._names[lo:hi]  # pylint: disable=protected-access
+        result._directories = self._directories  # pylint: disable=protected-access
+        result._directory_index = self._directory_index  # pylint: disable=protected-access
+        return result
+
+    def __repr__(self) -> str:
+        """Represent the set succinctly, but not ``eval``-able."""
+        return 'MatchSet(len={}, directories={}, sorted={})'.format(
+            len(self._micros), len(self._directories), self._sorted)
+
+
+class ListingBudget:
+    """
+    Limit the rate and the concurrency of the directory listings.
+
+    The budget is thread-safe and can be shared among the walks, *e.g.*, to run a background walk at a low
+    priority next to the latency-sensitive ones. Use it as a context manager around each listing.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 listings_per_second: Optional[float] = None,
+                 max_concurrent: Optional[int] = None,
+                 burst: int = 1) -> None:
+        """
+        Initialize with the given values.
+
+        :param listings_per_second: maximum average rate of the listings; None if unlimited
+        :param max_concurrent: maximum number of listings in progress at the same time; None if unlimited
+        :param burst: maximum number of listings which can start at once after the budget has been idle
+        """
+        if listings_per_second is not None and listings_per_second <= 0:
+            raise ValueError("Expected listings_per_second > 0, but got: {}".format(listings_per_second))
+
+        if max_concurrent is not None and max_concurrent < 1:
+            raise ValueError("Expected max_concurrent >= 1, but got: {}".format(max_concurrent))
+
+        if burst < 1:
+            raise ValueError("Expected burst >= 1, but got: {}".format(burst))
+
+        self.listings_per_second = listings_per_second
+        self.max_concurrent = max_concurrent
+        self.burst = burst
+
+        # token bucket limiting the rate
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+        self._semaphore = None  # type: Optional[threading.BoundedSemaphore]
+        if max_concurrent is not None:
+            self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+        # set while the listings are allowed to proceed
+        self._running = threading.Event()
+        self._running.set()
+
+    def pause(self) -> None:
+        """Block the listings which have not started yet until :py:meth:`resume` is called."""
+        self._running.clear()
+
+    def resume(self) -> None:
+        """Let the blocked listings proceed."""
+        self._running.set()
+
+    @property
+    def paused(self) -> bool:
+        """Return True if the budget has been paused."""
+        return not self._running.is_set()
+
+    def _take_token(self) -> None:
+        """Wait until the rate allows for another listing."""
+        if self.listings_per_second is None:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(float(self.burst),
+                                   self._tokens + (now - self._updated) * self.listings_per_second)
+                self._updated = now
+
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+
+                delay = (1.0 - self._tokens) / self.listings_per_second
+
+            time.sleep(delay)
+
+    def acquire(self) -> None:
+        """Wait until a listing can start within the budget."""
+        self._running.wait()
+        self._take_token()
+
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+
+    def release(self) -> None:
+        """Mark that a listing finished."""
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def __enter__(self) -> 'ListingBudget':
+        """Acquire the budget for a listing."""
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        """Release the budget of the listing."""
+        self.release()
+
+
+# remaining files with their matches and the sub-directories (path, level, match) of a listed directory
+_Expansion = Tuple[List[Tuple[str, Match]], List[Tuple[str, int, Match]]]
+
+# type of the paths returned by a walk
+PathT = TypeVar('PathT', str, bytes, pathlib.Path)
+
+
+class Walk(Generic[PathT]):
+    """
+    Iterate over the files matching a pattern on the file system.
+
+    The directories are listed in a depth-first manner. The entries of each directory are processed in
+    lexicographical order so that the walk is deterministic and can be resumed from a :py:class:`Cursor`.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    @overload
+    def __init__(self: 'Walk[pathlib.Path]',
+                 pattern: str,
+                 shard_index: Optional[int] = ...,
+                 shard_count: Optional[int] = ...,
+                 shard_level: Optional[int] = ...,
+                 on_error: str = ...,
+                 deadline: Optional[float] = ...,
+                 cursor: Optional[Cursor] = ...,
+                 start: Optional[datetime.datetime] = ...,
+                 end: Optional[datetime.datetime] = ...,
+                 backend: Optional[Backend] = ...,
+                 read_ahead: int = ...,
+                 with_stat: bool = ...,
+                 exclude: Optional[Sequence[str]] = ...,
+                 path_type: Type[pathlib.Path] = ...,
+                 stop_at_level: Optional[int] = ...,
+                 budget: Optional['ListingBudget'] = ...,
+                 collapse: bool = ...) -> None:
+        # pylint: disable=too-many-arguments
+        # pylint: disable=too-many-locals
+        ...
+
+    @overload
+    def __init__(self,
+                 pattern: str,
+                 shard_index: Optional[int] = ...,
+                 shard_count: Optional[int] = ...,
+                 shard_level: Optional[int] = ...,
+                 on_error: str = ...,
+                 deadline: Optional[float] = ...,
+                 cursor: Optional[Cursor] = ...,
+                 start: Optional[datetime.datetime] = ...,
+                 end: Optional[datetime.datetime] = ...,
+                 backend: Optional[Backend] = ...,
+                 read_ahead: int = ...,
+                 with_stat: bool = ...,
+                 exclude: Optional[Sequence[str]] = ...,
+                 path_type: Type[PathT] = ...,
+                 stop_at_level: Optional[int] = ...,
+                 budget: Optional['ListingBudget'] = ...,
+                 collapse: bool = ...) -> None:
+        # pylint: disable=too-many-arguments
+        # pylint: disable=too-many-locals
+        ...
+
+    def __init__(self,
+                 pattern: str,
+                 shard_index: Optional[int] = None,
+                 shard_count: Optional[int] = None,
+                 shard_level: Optional[int] = None,
+                 on_error: str = 'raise',
+                 deadline: Optional[float] = None,
+                 cursor: Optional[Cursor] = None,
+                 start: Optional[datetime.datetime] = None,
+                 end: Optional[datetime.datetime] = None,
+                 backend: Optional[Backend] = None,
+                 read_ahead: int = 0,
+                 with_stat: bool = False,
+                 exclude: Optional[Sequence[str]] = None,
+                 path_type: Any = pathlib.Path,
+                 stop_at_level: Optional[int] = None,
+                 budget: Optional['ListingBudget'] = None,
+                 collapse: bool = False) -> None:
+        """
+        Initialize the walk; see :py:func:`walk` for the parameters.
+
+        :raises: ValueError if the parameters are invalid
+        """
+        # pylint: disable=too-many-arguments
+        # pylint: disable=too-many-branches
+        # pylint: disable=too-many-locals
+        # pylint: disable=too-many-statements
+        if (shard_index is None) != (shard_count is None):
+            raise ValueError("Expected both shard_index and shard_count to be set or both to be None, "
+                             "but got shard_index: {}, shard_count: {}".format(shard_index, shard_count))
+
+        if shard_count is not None and shard_count < 1:
+            raise ValueError("Expected shard_count >= 1, but got: {}".format(shard_count))
+
+        if shard_index is not None and shard_count is not None and not 0 <= shard_index < shard_count:
+            raise ValueError("Expected shard_index in [0, {}), but got: {}".format(shard_count, shard_index))
+
+        if on_error not in ON_ERROR_POLICIES:
+            raise ValueError("Expected on_error to be one of {}, but got: {!r}".format(ON_ERROR_POLICIES, on_error))
+
+        if cursor is not None and cursor.pattern != pattern:
+            raise ValueError("The cursor has been obtained for a different pattern {!r}, "
+                             "but the pattern is: {!r}".format(cursor.pattern, pattern))
+
+        if read_ahead < 0:
+            raise ValueError("Expected read_ahead >= 0, but got: {}".format(read_ahead))
+
+        if path_type not in (str, bytes, pathlib.Path):
+            raise ValueError("Expected path_type to be str, bytes or pathlib.Path, but got: {}".format(path_type))
+
+        if collapse and end is None:
+            raise ValueError("Expected end to be set if collapse is set.")
+
+        self.pattern = pattern
+        self.on_error = on_error
+        self.deadline = deadline
+        self.backend = backend if backend is not None else LocalBackend()
+        self.read_ahead = read_ahead
+        self.with_stat = with_stat
+        self.path_type = path_type  # type: Type[PathT]
+        self.budget = budget
+
+        converter = str  # type: Any
+        if path_type is bytes:
+            converter = os.fsencode
+        elif path_type is pathlib.Path:
+            converter = pathlib.Path
+        self._as_path_type = converter  # type: Callable[[str], PathT]
+
+        # (path, levels) -> future listing of the directory which has been scheduled ahead
+        self._executor = None  # type: Optional[concurrent.futures.ThreadPoolExecutor]
+        self._scheduled = dict()  # type: Dict[Tuple[str, Tuple[int, ...]], concurrent.futures.Future[List[Entry]]]
+
+        # errors encountered during the walk as (path, error); filled only if on_error is 'collect'
+        self.errors = []  # type: List[Tuple[str, OSError]]
+
+        # set if the walk stopped since the deadline passed
+        self.timed_out = False
+
+        self.collapse = collapse
+
+        self._prefix, self._patsegs = parse_pattern_as_prefix_segments(pattern=pattern)
+
+        # set if only the directories matching the truncated pattern are walked
+        self._dirs_only = stop_at_level is not None
+        if stop_at_level is not None:
+            prefix_count = len(parse_pattern(pattern=pattern)) - len(self._patsegs)
+            if not prefix_count < stop_at_level <= prefix_count + len(self._patsegs):
+                raise ValueError("Expected stop_at_level in ({}, {}] for the pattern {}, but got: {}".format(
+                    prefix_count, prefix_count + len(self._patsegs), pattern, stop_at_level))
+
+            self._patsegs = self._patsegs[:stop_at_level - prefix_count]
+
+        if shard_level is not None and not 0 <= shard_level < len(self._patsegs):
+            raise ValueError("Expected shard_level in [0, {}) for the pattern {}, but got: {}".format(
+                len(self._patsegs), pattern, shard_level))
+
+        if shard_level is None:
+            shard_level = 0
+            for i, patseg in enumerate(self._patsegs):
+                if len(patseg.group_map) > 0 or patseg.recursive:
+                    shard_level = i
+                    break
+
+        self._shard_index = shard_index
+        self._shard_count = shard_count
+
+        # entries at this depth below the prefix are partitioned among the shards
+        self._shard_depth = shard_level + 1
+
+        # index of the first non-recursive pattern segment following each pattern segment
+        self._following = [0] * len(self._patsegs)  # type: List[int]
+        following = len(self._patsegs)
+        for i in reversed(range(len(self._patsegs))):
+            self._following[i] = following
+            if not self._patsegs[i].recursive:
+                following = i
+
+        # whether the path is a complete match if it consumed the pattern segments up to the index
+        self._accepting = [False] * (len(self._patsegs) + 1)  # type: List[bool]
+        self._accepting[len(self._patsegs)] = True
+        for i in reversed(range(len(self._patsegs))):
+            self._accepting[i] = self._patsegs[i].recursive and self._accepting[i + 1]
+
+        # multiple recursive wildcards can match the same path in different ways, so we need to de-duplicate.
+        self._seen_frames = None  # type: Optional[Set[Tuple[str, int, Tuple[Optional[int], ...]]]]
+        self._seen_leaves = None  # type: Optional[Set[str]]
+        if sum(1 for patseg in self._patsegs if patseg.recursive) > 1:
+            self._seen_frames = set()
+            self._seen_leaves = set()
+
+        self.start = start
+        self.end = end
+        self._ranged = start is not None or end is not None
+
+        # exclusions matched against the names of the entries, and against the whole paths, respectively
+        self._exclude_segments = []  # type: List[PatternSegment]
+        self._exclude_matchers = []  # type: List[Matcher]
+        for exclusion in ([] if exclude is None else exclude):
+            if '/' not in exclusion:
+                self._exclude_segments.append(parse_pattern_segment(pattern_segment=exclusion))
+                continue
+
+            if exclusion.startswith('/') != pattern.startswith('/'):
+                raise ValueError("Expected the exclusion {!r} to be {} as the pattern: {}".format(
+                    exclusion, 'absolute' if pattern.startswith('/') else 'relative', pattern))
+
+            self._exclude_matchers.append(Matcher(pattern=exclusion))
+
+        # Entries at an order-preserving level are selected by bisecting the sorted listing instead of
+        # matching each entry if the range is given. The values are the ranks of the least significant fields
+        # known before and after the level, respectively.
+        self._bisectable = [None] * len(self._patsegs)  # type: List[Optional[Tuple[int, int]]]
+        if self._ranged:
+            _check_range_fields(pattern=pattern, pattern_segments=self._patsegs)
+
+            ranks_before = set()  # type: Set[int]
+            for i, patseg in enumerate(self._patsegs):
+                ranks = set(_segment_ranks(patseg))
+                new_ranks = ranks - ranks_before
+                ranks_after = ranks_before | ranks
+
+                if patseg.order_preserving and new_ranks and \
+                        min(new_ranks) > max(ranks_before, default=-1) and \
+                        ranks_after == set(range(max(ranks_after) + 1)):
+                    self._bisectable[i] = (max(ranks_before, default=-1), max(ranks_after))
+
+                ranks_before = ranks_after
+
+        self._stack = []  # type: List[Tuple[str, int, Match]]
+        self._current = None  # type: Optional[List[Tuple[str, int, Match]]]
+        self._after = None  # type: Optional[str]
+
+        if cursor is not None:
+            self._stack = list(cursor.stack)
+            self._current = None if cursor.current is None else list(cursor.current)
+            self._after = cursor.after
+        elif len(self._patsegs) > 0:
+            self._stack = [(self._prefix, 0, Match())]
+
+        self._iterator = self._run()
+
+    def __iter__(self) -> 'Walk[PathT]':
+        """Return the walk itself as it is an iterator."""
+        return self
+
+    def __next__(self) -> Tuple[Match, PathT]:
+        """
+        Advance the walk to the next matching file.
+
+        :return: (match, path as :py:attr:`Walk.path_type`)
+        """
+        mtch, pth, _, _ = next(self._iterator)
+        return mtch, self._as_path_type(pth)
+
+    def with_stats(self) -> Iterator[Tuple[Match, PathT, FileStat]]:
+        """
+        Iterate over the remaining results of the walk together with the metadata of the files.
+
+        :return: (match, path as :py:attr:`Walk.path_type`, metadata)
+        """
+        if not self.with_stat:
+            raise ValueError("Expected the walk to be performed with with_stat set in order to iterate over the stats.")
+
+        for mtch, pth, stat, _ in self._iterator:
+            assert stat is not None, "Expected the metadata of {!r} since with_stat is set".format(pth)
+            yield mtch, self._as_path_type(pth), stat
+
+    def entries(self) -> Iterator[Tuple[Match, PathT, Optional[FileStat], Entry]]:
+        """
+        Iterate over the remaining results of the walk together with their directory entries.
+
+        Iterate over the entries instead of the walk itself if you need to know whether a result is a directory
+        (see :py:attr:`Entry.is_dir`), *e.g.*, with ``collapse`` or ``stop_at_level``.
+
+        :return: (match, path as :py:attr:`Walk.path_type`, metadata if the walk is performed with it, entry)
+        """
+        for mtch, pth, stat, entry in self._iterator:
+            yield mtch, self._as_path_type(pth), stat, entry
+
+    @property
+    def cursor(self) -> Cursor:
+        """Capture the current position of the walk so that it can be resumed later."""
+        return Cursor(
+            pattern=self.pattern,
+            stack=list(self._stack),
+            current=None if self._current is None else list(self._current),
+            after=self._after)
+
+    def _fetch_unsorted(self, path: str, levels: Sequence[int]) -> List[Entry]:
+        """
+        List the directory through the backend.
+
+        If all the pattern segments have candidate names, only the candidates are looked up instead of listing
+        the whole directory.
+
+        :param path: to the directory
+        :param levels: indices of the pattern segments (below the prefix) which the entries should match
+        :return: entries of the directory in arbitrary order
+        """
+        if all(self._patsegs[level].candidates is not None for level in levels):
+            candidates = set()  # type: Set[str]
+            for level in levels:
+                candidates.update(self._patsegs[level].candidates or [])
+
+            return self.backend.lookup(path=path, names=sorted(candidates))
+
+        entries = []  # type: List[Entry]
+        for page in self.backend.list_pages(path=path):
+            entries.extend(page)
+
+        return entries
+
+    def _fetch(self, path: str, levels: Sequence[int]) -> List[Entry]:
+        """
+        List the directory through the backend within the budget, if any.
+
+        :param path: to the directory
+        :param levels: indices of the pattern segments (below the prefix) which the entries should match
+        :return: entries of the directory sorted by name
+        """
+        if self.budget is not None:
+            with self.budget:
+                entries = self._fetch_unsorted(path=path, levels=levels)
+        else:
+            entries = self._fetch_unsorted(path=path, levels=levels)
+
+        entries.sort(key=lambda entry: entry.name)
+        return entries
+
+    def _schedule_read_ahead(self) -> None:
+        """List ahead the directories which will be popped next from the stack."""
+        if self.read_ahead == 0:
+            return
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.read_ahead)
+
+        end = len(self._stack)
+        for _ in range(self.read_ahead):
+            if end == 0:
+                break
+
+            start = self._group_start(end=end)
+            path = self._stack[start][0]
+            levels = tuple(level for _, level, _ in self._stack[start:end])
+            if (path, levels) not in self._scheduled:
+                self._scheduled[(path, levels)] = self._executor.submit(self._fetch, path, levels)
+
+            end = start
+
+    def _group_start(self, end: int) -> int:
+        """
+        Find the frames on the stack which share the path of the frame below the given index.
+
+        The ways in which a directory is matched below a recursive wildcard are pushed next to each other,
+        and they are popped together so that the directory is listed only once.
+
+        :param end: index (exclusive) of the last frame of the group
+        :return: index (inclusive) of the first frame of the group
+        """
+        path = self._stack[end - 1][0]
+
+        start = end - 1
+        while start > 0 and self._stack[start - 1][0] == path:
+            start -= 1
+
+        return start
+
+    def _list(self, path: str, levels: Sequence[int]) -> Optional[List[Entry]]:
+        """
+        List the directory in lexicographical order.
+
+        :param path: to the directory
+        :param levels: indices of the pattern segments (below the prefix) which the entries should match
+        :return: entries sorted by name; None if the directory could not be listed and the error is ignored
+        """
+        try:
+            future = self._scheduled.pop((path, tuple(levels)), None)
+            if future is not None:
+                return future.result()
+
+            return self._fetch(path=path, levels=levels)
+
+        except OSError as err:
+            if self.on_error == 'raise':
+                raise
+
+            if self.on_error == 'collect':
+                self.errors.append((path, err))
+
+            return None
+
+    def close(self) -> None:
+        """Stop the walk and release its resources."""
+        self._iterator.close()
+
+    def collect(self) -> MatchSet:
+        """
+        Collect the remaining matches of the walk compactly.
+
+        The metadata of the files, if any, is not collected.
+
+        :return: matches and paths of the walk in the order of the walk
+        """
+        result = MatchSet(path_type=self.path_type)
+        for mtch, pth, _, _ in self._iterator:
+            result.add(match=mtch, path=pth)
+
+        return result
+
+    def _bisect(self, names: List[str], level: int, mtch: Match) -> Tuple[int, int]:
+        """
+        Find the range of the sorted entries of an order-preserving level which can intersect the walked range.
+
+        :param names: sorted names of the directory entries
+        :param level: index of the pattern segment (below the prefix) which the entries should match
+        :param mtch: match of the parent directory
+        :return: start (inclusive) and end (exclusive) index of the entries
+        """
+        bisectable = self._bisectable[level]
+        assert bisectable is not None
+
+        rank_before, rank_after = bisectable
+        patseg = self._patsegs[level]
+
+        known = []  # type: List[int]
+        for value in _match_as_list(mtch)[:rank_before + 1]:
+            assert value is not None, "Expected the fields preceding an order-preserving level to be set."
+            known.append(value)
+
+        lo = 0
+        hi = len(names)
+
+        if self.start is not None:
+            bound_fields = _datetime_fields(self.start)[:rank_before + 1]
+            century = _century_position(patseg, self.start)
+
+            if known < bound_fields or (known == bound_fields and century > 0):
+                return 0, 0
+
+            if known == bound_fields and century == 0:
+                lo = bisect.bisect_left(names, _render_segment(patseg, self.start))
+
+        if self.end is not None:
+            bound_fields = _datetime_fields(self.end)[:rank_before + 1]
+            century = _century_position(patseg, self.end)
+
+            if known > bound_fields or (known == bound_fields and century < 0):
+                return 0, 0
+
+            if known == bound_fields and century == 0:
+                upper = _render_segment(patseg, self.end)
+                if _truncate(self.end, rank_after) == self.end:
+                    hi = bisect.bisect_left(names, upper)
+                else:
+                    # the entry named exactly as the upper bound starts before the end
+                    hi = bisect.bisect_right(names, upper)
+
+        return lo, max(lo, hi)
+
+    def _in_range(self, mtch: Match, is_leaf: bool) -> bool:
+        """
+        Check whether the match lies in the walked range.
+
+        :param mtch: match of a directory entry
+        :param is_leaf: if set, the entry is a complete match; otherwise, it needs to be descended into
+        :return: True if the entry should be yielded (if leaf) or descended into (if not leaf)
+        """
+        span = _match_span(mtch)
+        if span is None:
+            # we can not decide on partial matches.
+            return not is_leaf
+
+        span_start, span_end = span
+        if is_leaf:
+            return (self.start is None or self.start <= span_start) and (self.end is None or span_start < self.end)
+
+        return (self.start is None or self.start < span_end) and (self.end is None or span_start < self.end)
+
+    def _before_end(self, mtch: Match) -> bool:
+        """
+        Check whether the match of a directory lies entirely before the end of the walked range.
+
+        :param mtch: partial match of the directory
+        :return: True if all the matches below the directory are known to precede the end
+        """
+        if self.end is None:
+            return False
+
+        span = _match_span(mtch)
+        return span is not None and span[1] <= self.end
+
+    def _excluded(self, path: str, name: str) -> bool:
+        """
+        Check whether the directory entry is excluded from the walk.
+
+        :param path: to the entry
+        :param name: of the entry
+        :return: True if any exclusion matches the entry
+        """
+        for patseg in self._exclude_segments:
+            if match_segment(segment=name, pattern_segment=patseg) is not None:
+                return True
+
+        for matcher in self._exclude_matchers:
+            if matcher.match(path=path) is not None:
+                return True
+
+        return False
+
+    def _successors(self, name: str, level: int, mtch: Match) -> List[Tuple[int, Match]]:
+        """
+        Determine the states of the walk after consuming the directory entry.
+
+        :param name: of the directory entry
+        :param level: index of the pattern segment (below the prefix) which the entry should match
+        :param mtch: match of the parent directory
+        :return: (index of the next pattern segment, updated match) for each way the entry can be matched
+        """
+        patseg = self._patsegs[level]
+        if not patseg.recursive:
+            name_mtch = match_segment(segment=name, pattern_segment=patseg, match=mtch)
+            return [] if name_mtch is None else [(level + 1, name_mtch)]
+
+        # the recursive wildcard either consumes the entry or matches zero segments
+        # so that the entry is matched by the following segment.
+        result = [(level, mtch)]
+
+        following = self._following[level]
+        if following < len(self._patsegs):
+            name_mtch = match_segment(segment=name, pattern_segment=self._patsegs[following], match=mtch)
+            if name_mtch is not None:
+                result.append((following + 1, name_mtch))
+
+        return result
+
+    def _expand(self, path: str, level: int, mtch: Match, entries: List[Entry],
+                after: Optional[str]) -> Tuple[List[Tuple[Entry, Match]], List[Tuple[str, int, Match]]]:
+        """
+        Determine the matching files and the sub-directories to be descended into from a directory listing.
+
+        :param path: to the directory
+        :param level: index of the pattern segment (below the prefix) which the entries should match
+        :param mtch: match of the directory
+        :param entries: of the directory sorted by name
+        :param after: if set, only the entries following this name are considered
+        :return: (matching entries with their matches, sub-directories as stack frames)
+        """
+        # pylint: disable=too-many-arguments
+        # pylint: disable=too-many-branches
+        # pylint: disable=too-many-locals
+        # pylint: disable=too-many-nested-blocks
+        # depth of the entries below the prefix; only needed for sharding
+        depth = -1
+        if self._shard_count is not None:
+            depth = 1 if path == self._prefix else _relative(prefix=self._prefix, path=path).count('/') + 2
+
+        lo = 0
+        hi = len(entries)
+
+        names = []  # type: List[str]
+        if after is not None or self._bisectable[level] is not None:
+            names = [entry.name for entry in entries]
+
+        if after is not None:
+            lo = bisect.bisect_right(names, after)
+
+        if self._bisectable[level] is not None:
+            range_lo, range_hi = self._bisect(names=names, level=level, mtch=mtch)
+            lo = max(lo, range_lo)
+            hi = min(hi, range_hi)
+
+        leaves = []  # type: List[Tuple[Entry, Match]]
+        subdirs = []  # type: List[Tuple[str, int, Match]]
+        for i in range(lo, hi):
+            entry = entries[i]
+            name = entry.name
+
+            successors = self._successors(name=name, level=level, mtch=mtch)
+            if not successors:
+                continue
+
+            if self._exclude_segments or self._exclude_matchers:
+                if self._excluded(path=_join(path, name), name=name):
+                    continue
+
+            if self._shard_count is not None and depth <= self._shard_depth:
+                in_shard = _shard_of(
+                    relative_path=_relative(prefix=self._prefix, path=_join(path, name)),
+                    shard_count=self._shard_count) == self._shard_index
+
+                if not in_shard and depth == self._shard_depth:
+                    continue
+            else:
+                in_shard = True
+
+            # only the directories are returned if the walk stops above the files
+            is_leaf = False
+            can_be_leaf = not self._dirs_only or entry.is_dir
+
+            for next_level, next_mtch in successors:
+                if not is_leaf and can_be_leaf and self._accepting[next_level] and \
+                        (not self._ranged or self._in_range(mtch=next_mtch, is_leaf=not self._dirs_only)):
+                    is_leaf = True
+                    if in_shard:
+                        leaves.append((entry, next_mtch))
+
+                # skip non-directories, since recursion needs to descend.
+                if next_level < len(self._patsegs) and \
+                        (not self._ranged or self._in_range(mtch=next_mtch, is_leaf=False)) and entry.is_dir:
+                    # the recursive wildcard does not follow the links so that the walk ends on cyclic links.
+                    if next_level == level and self._patsegs[level].recursive and entry.is_symlink:
+                        continue
+
+                    if self.collapse and self._before_end(mtch=next_mtch):
+                        if not is_leaf:
+                            is_leaf = True
+                            if in_shard:
+                                leaves.append((entry, next_mtch))
+                    else:
+                        subdirs.append((_join(path, name), next_level, next_mtch))
+
+        return leaves, subdirs
+
+    def _expand_group(self, frames: List[Tuple[str, int, Match]], entries: List[Entry],
+                      after: Optional[str]) -> Tuple[List[Tuple[Entry, Match]], List[Tuple[str, int, Match]]]:
+        """
+        Determine the matching files and the sub-directories of a directory matched in one or more ways.
+
+        :param frames: of the directory sharing its path
+        :param entries: of the directory sorted by name
+        :param after: if set, only the entries following this name are considered
+        :return: (matching entries with their matches, sub-directories as stack frames), both sorted by name
+        """
+        if len(frames) == 1:
+            path, level, mtch = frames[0]
+            return self._expand(path=path, level=level, mtch=mtch, entries=entries, after=after)
+
+        leaves = []  # type: List[Tuple[Entry, Match]]
+        subdirs = []  # type: List[Tuple[str, int, Match]]
+        for path, level, mtch in frames:
+            frame_leaves, frame_subdirs = self._expand(
+                path=path, level=level, mtch=mtch, entries=entries, after=after)
+            leaves.extend(frame_leaves)
+            subdirs.extend(frame_subdirs)
+
+        # an entry matched in several ways is yielded only once.
+        unique_leaves = collections.OrderedDict()  # type: MutableMapping[str, Tuple[Entry, Match]]
+        for entry, mtch in sorted(leaves, key=lambda leaf: leaf[0].name):
+            unique_leaves.setdefault(entry.name, (entry, mtch))
+
+        # the sort is stable so that the ways of matching a sub-directory stay in order.
+        subdirs.sort(key=lambda subdir: subdir[0])
+
+        return list(unique_leaves.values()), subdirs
+
+    def _sample(self, k: int, rand: random.Random) -> List[Tuple[Match, str]]:
+        """
+        Draw the matching files by random descents from the fixed prefix.
+
+        The listings are cached so that each directory is listed at most once. A sub-directory is chosen with
+        the probability proportional to the estimated number of the matching files below it. The estimate is
+        exact for the directories whose sub-tree has been fully listed, and otherwise it is extrapolated from
+        the average fan-out of the levels observed so far. The averages are smoothed so that a directory which
+        has not been listed yet is always estimated to contain some files; the drawing stops only once all
+        the remaining directories have been listed and found empty. The drawn files are removed from the cached
+        listings so that the files are drawn without replacement.
+
+        :param k: number of files to be drawn
+        :param rand: random number generator
+        :return: drawn files with their matches; fewer than ``k`` if there are not enough matching files
+        """
+        # pylint: disable=too-many-locals
+        # frame key -> (remaining files, sub-directories) of the listed directory
+        expansions = dict()  # type: Dict[Tuple[str, int, Tuple[Optional[int], ...]], _Expansion]
+
+        # level -> [total fan-out, number of listed directories]
+        fan_outs = collections.defaultdict(lambda: [0, 0])  # type: Dict[int, List[int]]
+
+        # (path, looked-up candidates) -> entries of the directory, shared by the frames of a directory below
+        # a recursive wildcard
+        listings = dict()  # type: Dict[Tuple[str, Optional[Tuple[str, ...]]], Optional[List[Entry]]]
+
+        def key_of(frame: Tuple[str, int, Match]) -> Tuple[str, int, Tuple[Optional[int], ...]]:
+            """Identify the frame."""
+            return frame[0], frame[1], tuple(_match_as_list(frame[2]))
+
+        def estimate(frame: Tuple[str, int, Match]) -> float:
+            """Estimate the number of the remaining matching files below the directory."""
+            expansion = expansions.get(key_of(frame), None)
+            if expansion is not None:
+                files, subdirs = expansion
+                return len(files) + sum(estimate(subdir) for subdir in subdirs)
+
+            # Smooth the average so that an empty directory listed first does not rule out its siblings.
+            result = 1.0
+            for level in range(frame[1], len(self._patsegs)):
+                total, count = fan_outs[level]
+                result *= (total + 1) / (count + 1)
+
+            return result
+
+        def expand(frame: Tuple[str, int, Match]) -> _Expansion:
+            """List the directory of the frame, if not already listed."""
+            key = key_of(frame)
+            if key not in expansions:
+                path, level, mtch = frame
+                candidates = self._patsegs[level].candidates
+                listing_key = (path, None if candidates is None else tuple(candidates))
+                if listing_key not in listings:
+                    listings[listing_key] = self._list(path=path, levels=[level])
+
+                entries = listings[listing_key]
+
+                leaves, subdirs = [], []  # type: Tuple[List[Tuple[Entry, Match]], List[Tuple[str, int, Match]]]
+                if entries is not None:
+                    leaves, subdirs = self._expand(path=path, level=level, mtch=mtch, entries=entries, after=None)
+
+                files = [(_join(path, entry.name), name_mtch) for entry, name_mtch in leaves]
+                expansions[key] = (files, subdirs)
+
+                fan_outs[level][0] += len(files) + len(subdirs)
+                fan_outs[level][1] += 1
+
+            return expansions[key]
+
+        root = (self._prefix, 0, Match())  # type: Tuple[str, int, Match]
+
+        drawn = collections.OrderedDict()  # type: MutableMapping[str, Match]
+        while len(drawn) < k and len(self._patsegs) > 0:
+            expand(root)
+            if estimate(root) == 0:
+                break
+
+            frame = root
+            while True:
+                files, subdirs = expand(frame)
+                weights = [1.0] * len(files) + [estimate(subdir) for subdir in subdirs]
+                total = sum(weights)
+                if total == 0:
+                    break
+
+                threshold = rand.random() * total
+                chosen = len(weights) - 1
+                cumulative = 0.0
+                for i, weight in enumerate(weights):
+                    cumulative += weight
+                    if threshold < cumulative and weight > 0:
+                        chosen = i
+                        break
+
+                if chosen < len(files):
+                    pth, mtch = files.pop(chosen)
+                    if pth not in drawn:
+                        drawn[pth] = mtch
+                    break
+
+                frame = subdirs[chosen - len(files)]
+
+        return [(mtch, pth) for pth, mtch in drawn.items()]
+
+    def _run(self) -> Generator[Tuple[Match, str, Optional[FileStat], Entry], None, None]:
+        """Perform the walk and yield (match, path, metadata, directory entry of the path)."""
+        try:
+            yield from self._walk_stack()
+        finally:
+            for future in self._scheduled.values():
+                future.cancel()
+
+            self._scheduled.clear()
+
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _walk_stack(self) -> Iterator[Tuple[Match, str, Optional[FileStat], Entry]]:
+        """Pop the directories from the stack until it is empty."""
+        # pylint: disable=too-many-branches
+        # pylint: disable=too-many-locals
+        # pylint: disable=too-many-statements
+        # pylint: disable=too-many-nested-blocks
+        while True:
+            if self._current is None:
+                if not self._stack:
+                    return
+
+                if self.deadline is not None and time.time() >= self.deadline:
+                    self.timed_out = True
+                    return
+
+                start = self._group_start(end=len(self._stack))
+                self._current = list(reversed(self._stack[start:]))
+                del self._stack[start:]
+                self._after = None
+
+                self._schedule_read_ahead()
+
+            path = self._current[0][0]
+            for _, level, mtch in self._current:
+                if level >= len(self._patsegs):
+                    raise AssertionError("Unexpected code path: path: {}, level: {}, mtch: {}, stack: {}".format(
+                        path, level, mtch, self._stack))
+
+            if self._seen_frames is not None:
+                frame_keys = [(path, level, tuple(_match_as_list(mtch))) for _, level, mtch in self._current]
+                if self._after is None:
+                    self._current = [
+                        frame for frame, frame_key in zip(self._current, frame_keys)
+                        if frame_key not in self._seen_frames
+                    ]
+
+                    if not self._current:
+                        self._current = None
+                        continue
+
+                self._seen_frames.update(frame_keys)
+
+            entries = self._list(path=path, levels=[level for _, level, _ in self._current])
+            if entries is None:
+                self._current = None
+                continue
+
+            leaves, subdirs = self._expand_group(frames=self._current, entries=entries, after=self._after)
+
+            if self._after is None:
+                # push in reverse so that the sub-directories are popped in lexicographical order
+                self._stack.extend(reversed(subdirs))
+
+                # mark that the sub-directories have been pushed
+                self._after = ''
+
+            stats = [None] * len(leaves)  # type: Sequence[Union[None, FileStat, OSError]]
+            if self.with_stat and leaves:
+                stats = self.backend.stat_entries(path=path, entries=[entry for entry, _ in leaves])
+
+            for (entry, name_mtch), stat in zip(leaves, stats):
+                self._after = entry.name
+                pth = _join(path, entry.name)
+
+                if isinstance(stat, OSError):
+                    if self.on_error == 'raise':
+                        raise stat
+
+                    if self.on_error == 'collect':
+                        self.errors.append((pth, stat))
+
+                    continue
+
+                if self._seen_leaves is not None:
+                    if pth in self._seen_leaves:
+                        continue
+
+                    self._seen_leaves.add(pth)
+
+                # recursion ends here.
+                yield name_mtch, pth, stat, entry
+
+            self._current = None
+
+
+@overload
+def walk(pattern: str,
+         shard_index: Optional[int] = ...,
+         shard_count: Optional[int] = ...,
+         shard_level: Optional[int] = ...,
+         on_error: str = ...,
+         deadline: Optional[float] = ...,
+         cursor: Optional[Cursor] = ...,
+         start: Optional[datetime.datetime] = ...,
+         end: Optional[datetime.datetime] = ...,
+         backend: Optional[Backend] = ...,
+         read_ahead: int = ...,
+         with_stat: bool = ...,
+         exclude: Optional[Sequence[str]] = ...,
+         path_type: Type[pathlib.Path] = ...,
+         stop_at_level: Optional[int] = ...,
+         budget: Optional['ListingBudget'] = ...,
+         collapse: bool = ...) -> 'Walk[pathlib.Path]':
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+    ...
+
+
+@overload
+def walk(pattern: str,
+         shard_index: Optional[int] = ...,
+         shard_count: Optional[int] = ...,
+         shard_level: Optional[int] = ...,
+         on_error: str = ...,
+         deadline: Optional[float] = ...,
+         cursor: Optional[Cursor] = ...,
+         start: Optional[datetime.datetime] = ...,
+         end: Optional[datetime.datetime] = ...,
+         backend: Optional[Backend] = ...,
+         read_ahead: int = ...,
+         with_stat: bool = ...,
+         exclude: Optional[Sequence[str]] = ...,
+         path_type: Type[PathT] = ...,
+         stop_at_level: Optional[int] = ...,
+         budget: Optional['ListingBudget'] = ...,
+         collapse: bool = ...) -> 'Walk[PathT]':
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+    ...
+
+
+def walk(pattern: str,
+         shard_index: Optional[int] = None,
+         shard_count: Optional[int] = None,
+         shard_level: Optional[int] = None,
+         on_error: str = 'raise',
+         deadline: Optional[float] = None,
+         cursor: Optional[Cursor] = None,
+         start: Optional[datetime.datetime] = None,
+         end: Optional[datetime.datetime] = None,
+         backend: Optional[Backend] = None,
+         read_ahead: int = 0,
+         with_stat: bool = False,
+         exclude: Optional[Sequence[str]] = None,
+         path_type: Any = pathlib.Path,
+         stop_at_level: Optional[int] = None,
+         budget: Optional['ListingBudget'] = None,
+         collapse: bool = False) -> Any:
+    """
+    Walk the pattern on the file system and return all the matching files with their parsed timestamps.
+
+    If ``shard_index`` and ``shard_count`` are given, only the matches belonging to the given shard are returned.
+    The entries at the shard level are partitioned by hashing their paths relative to the fixed prefix so that
+    independent processes (or machines) with different shard indices cover disjoint subsets of the tree and
+    together cover the whole tree without any coordination.
+
+    The walk can be interrupted and resumed. Take its :py:attr:`Walk.cursor` (serializable with
+    :py:meth:`Cursor.to_json`) and pass it to a new walk with the same pattern to continue where the old walk stopped.
+
+    If ``start`` or ``end`` are given, the walk is restricted to the range. The pattern segments which are
+    order-preserving (see :py:attr:`PatternSegment.order_preserving`) are resolved by bisecting the sorted listings
+    instead of matching every entry.
+
+    :param pattern: that each file should match.
+    :param shard_index: index of the shard to be walked, in [0, shard_count)
+    :param shard_count: total number of shards
+    :param shard_level:
+        index of the pattern segment below the fixed prefix at which the entries are partitioned;
+        if not set, the first segment containing a strftime directive is used (or the first segment if there is none)
+    :param on_error:
+        what to do if a directory can not be listed (*e.g.*, a ``PermissionError`` or a stale NFS handle) or
+        the metadata of a file can not be retrieved: ``'raise'`` the error, ``'skip'`` the directory (or the file)
+        or ``'collect'`` the error in :py:attr:`Walk.errors` and skip the directory (or the file)
+    :param deadline:
+        if set, the walk stops before listing the next directory once the deadline (in seconds since epoch,
+        as given by ``time.time()``) passed, and :py:attr:`Walk.timed_out` is set
+    :param cursor: if set, resume the walk from this position
+    :param start:
+        if set, only the files with timestamps at or after the start are returned.
+        The directories which can not contain such files are not descended into.
+    :param end:
+        if set, only the files with timestamps before the end are returned.
+        The directories which can not contain such files are not descended into.
+    :param backend: lists the directories; if not set, the local file system is listed
+    :param read_ahead:
+        number of directories to be listed ahead in background threads so that the listing latency overlaps with
+        the consumption of the results
+    :param with_stat:
+        if set, the metadata of each matched file (see :py:class:`FileStat`) is retrieved from the listing.
+        Iterate over :py:meth:`Walk.with_stats` to obtain it.
+    :param exclude:
+        patterns of the entries to be excluded from the walk. A pattern without a slash is matched against
+        the name of each entry (*e.g.*, ``'*.tmp'``), while other patterns are matched against the whole path.
+        The excluded directories are not descended into.
+    :param path_type:
+        type of the returned paths: ``pathlib.Path``, ``str`` or ``bytes``. The string and bytes paths are joined
+        directly from the listings so that no ``pathlib.Path`` needs to be constructed.
+    :param stop_at_level:
+        If set, the walk stops at the directories matching the first ``stop_at_level`` segments of the pattern
+        (including the segments of the fixed prefix) and returns them with their partial matches instead of
+        the files. The returned directories are not listed. For example, ``/data/%Y/%m/%d/*.jpg`` with
+        ``stop_at_level=4`` returns the day directories. If the range is given, the directories whose time span
+        intersects the range are returned.
+    :param budget:
+        if set, each listing (or lookup) of a directory is charged to the budget so that the rate and
+        the concurrency of the listings are limited and the walk can be paused (see :py:class:`ListingBudget`)
+    :param collapse:
+        If set, the directories whose time span lies entirely before ``end`` are returned as a whole with their
+        partial matches instead of being descended into. Iterate over :py:meth:`Walk.entries` to tell them apart
+        from the files.
+    :return: iterator over the matched files and extracted timestamps
+    """
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+    return Walk(
+        pattern=pattern,
+        shard_index=shard_index,
+        shard_count=shard_count,
+        shard_level=shard_level,
+        on_error=on_error,
+        deadline=deadline,
+        cursor=cursor,
+        start=start,
+        end=end,
+        backend=backend,
+        read_ahead=read_ahead,
+        with_stat=with_stat,
+        exclude=exclude,
+        path_type=path_type,
+        stop_at_level=stop_at_level,
+        budget=budget,
+        collapse=collapse)
+
+
+def _directories_chronological(pattern_segments: List[PatternSegment]) -> bool:
+    """
+    Check whether the lexicographical order of the directories matching the pattern equals their chronological order.
+
+    This holds if the directory levels are order-preserving and give the fields from the year contiguously, so that
+    the time spans of different directories do not overlap.
+
+    :param pattern_segments: of the pattern; the last segment matches the files
+    :return: True if the directories are walked in chronological order
+    """
+    directory_segments = pattern_segments[:-1]
+    if not all(patseg.order_preserving for patseg in directory_segments):
+        return False
+
+    ranks = [rank for patseg in directory_segments for rank in _segment_ranks(patseg)]
+    return ranks == sorted(ranks) and set(ranks) == set(range(len(set(ranks))))
+
+
+def _chronological_walk(pattern: str, start: Optional[datetime.datetime], end: Optional[datetime.datetime],
+                        backend: Optional[Backend]) -> Iterator[Tuple[datetime.datetime, Match, pathlib.Path]]:
+    """
+    Walk the pattern and iterate over the matches in chronological order.
+
+    The matches are streamed if the pattern is order-preserving (see :py:attr:`Matcher.order_preserving`) since
+    the walk lists the directories in lexicographical order. If only the directory levels are order-preserving
+    and give the fields contiguously from the year (*e.g.*, ``%Y/%m/%d/cam*_%H%M.jpg``), the directories are walked
+    in chronological order and the matches of one directory at a time are sorted. Otherwise, all the matches need
+    to be sorted first.
+
+    :param pattern: to be walked
+    :param start: inclusive start of the range; None if unbounded
+    :param end: exclusive end of the range; None if unbounded
+    :param backend: lists the directories; if not set, the local file system is listed
+    :return: timestamps, matches and paths of the matched files
+    """
+    _check_range_fields(pattern=pattern, pattern_segments=parse_pattern(pattern))
+    wlk = Walk(pattern=pattern, start=start, end=end, backend=backend)
+
+    def timestamped() -> Iterator[Tuple[datetime.datetime, Match, pathlib.Path]]:
+        """Attach the timestamp to each match of the walk."""
+        for mtch, pth in wlk:
+            span = _match_span(mtch)
+            assert span is not None, "Expected a span since the pattern has been checked: {}".format(mtch)
+            yield span[0], mtch, pth
+
+    if Matcher(pattern=pattern).order_preserving:
+        return timestamped()
+
+    def sort_key(item: Tuple[datetime.datetime, Match, pathlib.Path]) -> Tuple[datetime.datetime, pathlib.Path]:
+        """Order the matches by timestamp and then by path."""
+        return item[0], item[2]
+
+    if _directories_chronological(pattern_segments=parse_pattern(pattern)):
+        # the walk yields the files of a directory one after another.
+        return (item for _, group in itertools.groupby(timestamped(), key=lambda item: item[2].parent)
+                for item in sorted(group, key=sort_key))
+
+    return iter(sorted(timestamped(), key=sort_key))
+
+
+GAP_KINDS = ('missing', 'duplicate')
+
+
+class Gap:
+    """Represent an interval of a time series where the files are missing or duplicated."""
+
+    def __init__(self, kind: str, start: datetime.datetime, end: datetime.datetime, count: int) -> None:
+        """
+        Initialize with the given values.
+
+        :param kind: 'missing' or 'duplicate'
+        :param start: inclusive start of the interval
+        :param end: exclusive end of the interval
+        :param count: number of missing files or number of superfluous files in the interval, respectively
+        """
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.count = count
+
+    def __repr__(self) -> str:
+        """Represent the gap succinctly, but not ``eval``-able."""
+        return 'Gap(kind={!r}, start={}, end={}, count={})'.format(self.kind, self.start, self.end, self.count)
+
+
+def find_gaps(pattern: str,
+              start: datetime.datetime,
+              end: datetime.datetime,
+              step: datetime.timedelta,
+              backend: Optional[Backend] = None) -> Iterator[Gap]:
+    """
+    Find the intervals where the files of a regular time series are missing or duplicated.
+
+    The expected timestamps (start, start + step, start + 2 * step, ...) are merged with the timestamps found on
+    the file system in a single pass. Neither expected nor found timestamps are held in memory if the pattern is
+    order-preserving (see :py:attr:`Matcher.order_preserving`). The found timestamps which do not lie on the grid
+    of the expected timestamps are ignored.
+
+    :param pattern: of the files
+    :param start: first expected timestamp
+    :param end: exclusive end of the expected timestamps
+    :param step: between the expected timestamps
+    :param backend: lists the directories; if not set, the local file system is listed
+    :return: gaps in chronological order; consecutive missing (or duplicated) timestamps are merged into one interval
+    """
+    # pylint: disable=too-many-branches
+    if step <= datetime.timedelta(0):
+        raise ValueError("Expected a positive step, but got: {}".format(step))
+
+    found = _chronological_walk(pattern=pattern, start=start, end=end, backend=backend)
+
+    current = next(found, None)
+
+    missing_start = None  # type: Optional[datetime.datetime]
+    missing_count = 0
+
+    duplicate_start = None  # type: Optional[datetime.datetime]
+    duplicate_count = 0
+
+    expected = start
+    while expected < end:
+        # skip the timestamps which are not on the grid
+        while current is not None and current[0] < expected:
+            current = next(found, None)
+
+        count = 0
+        while current is not None and current[0] == expected:
+            count += 1
+            current = next(found, None)
+
+        if count == 0:
+            if duplicate_start is not None:
+                yield Gap(kind='duplicate', start=duplicate_start, end=expected, count=duplicate_count)
+                duplicate_start = None
+                duplicate_count = 0
+
+            if missing_start is None:
+                missing_start = expected
+
+            missing_count += 1
+        else:
+            if missing_start is not None:
+                yield Gap(kind='missing', start=missing_start, end=expected, count=missing_count)
+                missing_start = None
+                missing_count = 0
+
+            if count > 1:
+                if duplicate_start is None:
+                    duplicate_start = expected
+
+                duplicate_count += count - 1
+
+            elif duplicate_start is not None:
+                yield Gap(kind='duplicate', start=duplicate_start, end=expected, count=duplicate_count)
+                duplicate_start = None
+                duplicate_count = 0
+
+        expected += step
+
+    if missing_start is not None:
+        yield Gap(kind='missing', start=missing_start, end=expected, count=missing_count)
+
+    if duplicate_start is not None:
+        yield Gap(kind='duplicate', start=duplicate_start, end=expected, count=duplicate_count)
+
+
+JOIN_HOWS = ('inner', 'left', 'outer')
+
+
+def join(patterns: Sequence[str],
+         tolerance: datetime.timedelta = datetime.timedelta(0),
+         how: str = 'inner',
+         start: Optional[datetime.datetime] = None,
+         end: Optional[datetime.datetime] = None,
+         backend: Optional[Backend] = None) -> Iterator[Tuple[Optional[Tuple[Match, pathlib.Path]], ...]]:
+    """
+    Align the files of two or more patterns by their timestamps.
+
+    The walks of the patterns are merged in chronological order in a single pass so that only the current file of
+    each pattern is held in memory, provided that the patterns are order-preserving
+    (see :py:attr:`Matcher.order_preserving`). Otherwise, the matches of each pattern need to be sorted first,
+    one directory at a time if the directory levels are order-preserving.
+
+    The earliest pending file of all the patterns anchors a row. Each pattern contributes to the row its earliest
+    pending file if the file lies within the tolerance after the anchor; each file is aligned only once.
+
+    :param patterns: of the files to be aligned
+    :param tolerance: maximum difference between the timestamps of the aligned files
+    :param how:
+        ``'inner'`` to return only the rows where all the patterns have a file, ``'left'`` to return the rows where
+        the first pattern has a file, or ``'outer'`` to return all the rows
+    :param start: inclusive start of the range; None if unbounded
+    :param end: exclusive end of the range; None if unbounded
+    :param backend: lists the directories; if not set, the local file system is listed
+    :return:
+        rows in chronological order; each row gives (match, path) of the aligned file for each pattern,
+        or None if the pattern has no file in the row
+    """
+    # pylint: disable=too-many-arguments
+    if len(patterns) < 2:
+        raise ValueError("Expected at least two patterns to join, but got: {}".format(len(patterns)))
+
+    if tolerance < datetime.timedelta(0):
+        raise ValueError("Expected a non-negative tolerance, but got: {}".format(tolerance))
+
+    if how not in JOIN_HOWS:
+        raise ValueError("Expected how to be one of {}, but got: {!r}".format(JOIN_HOWS, how))
+
+    streams = [
+        _chronological_walk(pattern=pattern, start=start, end=end, backend=backend) for pattern in patterns
+    ]
+
+    heads = [next(stream, None) for stream in streams]
+
+    while True:
+        pending = [head[0] for head in heads if head is not None]
+        if not pending:
+            return
+
+        anchor = min(pending)
+
+        row = []  # type: List[Optional[Tuple[Match, pathlib.Path]]]
+        for i, head in enumerate(heads):
+            if head is not None and head[0] - anchor <= tolerance:
+                row.append((head[1], head[2]))
+                heads[i] = next(streams[i], None)
+            else:
+                row.append(None)
+
+        if how == 'inner' and any(item is None for item in row):
+            continue
+
+        if how == 'left' and row[0] is None:
+            continue
+
+        yield tuple(row)
+
+
+class ArchiveMember:
+    """Represent a file member of an archive which is opened only on demand."""
+
+    def __init__(self, backend: ArchiveBackend, name: str, stat: FileStat) -> None:
+        """
+        Initialize with the given values.
+
+        :param backend: through which the member is read
+        :param name: path of the member in the archive
+        :param stat: metadata of the member
+        """
+        self.backend = backend
+        self.name = name
+        self.size = stat.size
+        self.mtime = stat.mtime
+
+    def open(self) -> IO[bytes]:
+        """Open the member for reading."""
+        return self.backend.open(self.name)
+
+    def __repr__(self) -> str:
+        """Represent the member succinctly, but not ``eval``-able."""
+        return 'ArchiveMember(archive={!r}, name={!r}, size={})'.format(self.backend.path, self.name, self.size)
+
+
+def match_archive(path: Union[str, pathlib.Path], pattern: str) -> Iterator[Tuple[Match, ArchiveMember]]:
+    """
+    Match the members of a tar or zip archive against the pattern without extracting the archive.
+
+    :param path: to the archive
+    :param pattern: which the paths of the members in the archive should match
+    :return: matches and members of the archive
+    """
+    backend = ArchiveBackend(path=path)
+    try:
+        for mtch, pth, stat in walk(pattern=pattern, backend=backend, with_stat=True, path_type=str).with_stats():
+            yield mtch, ArchiveMember(backend=backend, name=pth, stat=stat)
+    finally:
+        backend.close()
+
+
+class PlanLevel:
+    """Describe how a pattern segment below the fixed prefix is walked."""
+
+    def __init__(self, segment: str, kind: str, regex: Optional[str], order_preserving: bool) -> None:
+        """
+        Initialize with the given values.
+
+        :param segment: text of the pattern segment
+        :param kind:
+            ``'literal'`` if the entries are compared against a fixed text, ``'lookup'`` if the candidate entries
+            are looked up directly, ``'match'`` if the entries are matched against the regular expression and
+            ``'recursive'`` for the recursive wildcard
+        :param regex: regular expression of the segment, if any
+        :param order_preserving: True if a range can be found by bisecting the sorted listing
+        """
+        self.segment = segment
+        self.kind = kind
+        self.regex = regex
+        self.order_preserving = order_preserving
+
+        # number of sampled directories at this level
+        self.sampled = 0
+
+        # average number of matching entries per sampled directory; None if not estimated
+        self.fan_out = None  # type: Optional[float]
+
+        # estimated number of directories listed at this level; None if not estimated
+        self.estimated_listings = None  # type: Optional[float]
+
+
+class Plan:
+    """Describe how a walk of the pattern is going to be executed."""
+
+    def __init__(self, pattern: str, prefix: str, levels: List[PlanLevel]) -> None:
+        """
+        Initialize with the given values.
+
+        :param pattern: to be walked
+        :param prefix: fixed prefix which is not listed
+        :param levels: pattern segments below the prefix
+        """
+        self.pattern = pattern
+        self.prefix = prefix
+        self.levels = levels
+
+    @property
+    def estimated_listings(self) -> Optional[float]:
+        """Estimate the total number of directory listings; None if it could not be estimated."""
+        total = 0.0
+        for level in self.levels:
+            if level.estimated_listings is None:
+                return None
+
+            total += level.estimated_listings
+
+        return total
+
+    def __str__(self) -> str:
+        """Report the plan in a human-readable form."""
+        lines = ['pattern: {}'.format(self.pattern), 'fixed prefix: {!r}'.format(self.prefix)]
+        for i, level in enumerate(self.levels):
+            parts = ['level {}: {!r}'.format(i, level.segment), level.kind]
+            if level.regex is not None:
+                parts.append('regex {}'.format(level.regex))
+
+            if level.order_preserving:
+                parts.append('order-preserving')
+
+            if level.fan_out is not None:
+                parts.append('fan-out ~{:.1f} ({} sampled)'.format(level.fan_out, level.sampled))
+
+            if level.estimated_listings is not None:
+                parts.append('listings ~{:.0f}'.format(level.estimated_listings))
+
+            lines.append(', '.join(parts))
+
+        estimated = self.estimated_listings
+        if estimated is not None:
+            lines.append('estimated listings: ~{:.0f}'.format(estimated))
+        elif any(level.sampled > 0 for level in self.levels):
+            lines.append('estimated listings: unknown')
+
+        return '\n'.join(lines)
+
+    def __repr__(self) -> str:
+        """Represent the plan succinctly, but not ``eval``-able."""
+        return 'Plan(pattern={!r}, prefix={!r}, {} level(s))'.format(self.pattern, self.prefix, len(self.levels))
+
+
+def plan(pattern: str, sample_size: int = 3, backend: Optional[Backend] = None, seed: Optional[int] = None) -> Plan:
+    """
+    Plan the walk of the pattern and estimate its cost by sampling a few directories at each level.
+
+    The fan-out of a level is estimated as the average number of matching entries in the sampled directories.
+    The number of listings at a level is estimated as the product of the fan-outs of the preceding levels.
+    The estimation stops at the first recursive wildcard since its depth is unknown.
+
+    :param pattern: to be walked
+    :param sample_size: number of directories sampled per level; 0 disables the sampling
+    :param backend: lists the sampled directories; if not set, the local file system is listed
+    :param seed: of the random generator used for sampling
+    :return: plan of the walk
+    """
+    # pylint: disable=too-many-locals
+    # pylint: disable=too-many-branches
+    if sample_size < 0:
+        raise ValueError("Expected sample_size >= 0, but got: {}".format(sample_size))
+
+    prefix, patsegs = parse_pattern_as_prefix_segments(pattern=pattern)
+
+    levels = []  # type: List[PlanLevel]
+    for patseg in patsegs:
+        if patseg.recursive:
+            kind = 'recursive'
+        elif patseg.text is not None:
+            kind = 'literal'
+        elif patseg.candidates is not None:
+            kind = 'lookup'
+        else:
+            kind = 'match'
+
+        levels.append(
+            PlanLevel(
+                segment=''.join(content for _, content in patseg.tokens),
+                kind=kind,
+                regex=None if patseg.regex is None or patseg.recursive else patseg.regex.pattern,
+                order_preserving=patseg.order_preserving and patseg.text is None))
+
+    if sample_size == 0:
+        return Plan(pattern=pattern, prefix=prefix, levels=levels)
+
+    the_backend = backend if backend is not None else LocalBackend()
+    rand = random.Random(seed)
+
+    frontier = [(prefix, Match())]  # type: List[Tuple[str, Match]]
+    listings = 1.0
+    for patseg, level in zip(patsegs, levels):
+        if patseg.recursive or not frontier:
+            break
+
+        sampled = frontier if len(frontier) <= sample_size else rand.sample(frontier, sample_size)
+
+        next_frontier = []  # type: List[Tuple[str, Match]]
+        matched_count = 0
+        for path, mtch in sampled:
+            try:
+                if patseg.candidates is not None:
+                    entries = the_backend.lookup(path=path, names=patseg.candidates)
+                else:
+                    entries = the_backend.list_directory(path=path)
+            except OSError:
+                continue
+
+            level.sampled += 1
+            for entry in entries:
+                entry_mtch = match_segment(segment=entry.name, pattern_segment=patseg, match=mtch)
+                if entry_mtch is None:
+                    continue
+
+                matched_count += 1
+                if entry.is_dir:
+                    next_frontier.append((_join(path, entry.name), entry_mtch))
+
+        if level.sampled == 0:
+            break
+
+        level.estimated_listings = listings
+        level.fan_out = matched_count / level.sampled
+        listings *= level.fan_out
+
+        frontier = next_frontier
+
+    return Plan(pattern=pattern, prefix=prefix, levels=levels)
+
+
+class PruneResult:
+    """Summarize the outcome of :py:func:`prune`."""
+
+    def __init__(self, dry_run: bool) -> None:
+        """
+        Initialize an empty summary.
+
+        :param dry_run: if set, nothing has been removed and the counts refer to what would have been removed
+        """
+        self.dry_run = dry_run
+
+        # number of removed files
+        self.files = 0
+
+        # number of directories removed as a whole
+        self.directories = 0
+
+        # paths which would have been removed; only filled in a dry run
+        self.paths = []  # type: List[str]
+
+        # errors encountered during the walk and the removal as (path, error)
+        self.errors = []  # type: List[Tuple[str, OSError]]
+
+    def __repr__(self) -> str:
+        """Represent the summary succinctly, but not ``eval``-able."""
+        return 'PruneResult(dry_run={}, files={}, directories={}, errors={})'.format(
+            self.dry_run, self.files, self.directories, len(self.errors))
+
+
+def _execute_concurrently(func: Callable[..., Optional[OSError]], args: Iterable[Tuple[Any, ...]],
+                          workers: int) -> Iterator[Tuple[Tuple[Any, ...], Optional[OSError]]]:
+    """
+    Call the function on the arguments in a thread pool.
+
+    The arguments are consumed lazily, and only a bounded number of calls is pending at any time
+    so that a huge walk does not pile up the futures.
+
+    :param func: to be called; returns the error, if any
+    :param args: positional arguments of each call
+    :param workers: number of threads
+    :return: arguments and outcome of each call, in order of the arguments
+    """
+    pending = collections.deque()  # type: Deque[Tuple[Tuple[Any, ...], concurrent.futures.Future[Optional[OSError]]]]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for arg in args:
+            pending.append((arg, executor.submit(func, *arg)))
+
+            if len(pending) >= 16 * workers:
+                done_arg, future = pending.popleft()
+                yield done_arg, future.result()
+
+        while pending:
+            done_arg, future = pending.popleft()
+            yield done_arg, future.result()
+
+
+def _remove(path: str, is_dir: bool) -> Optional[OSError]:
+    """
+    Remove the file or the directory tree.
+
+    :param path: to be removed
+    :param is_dir: if set, the whole directory tree is removed
+    :return: error, if any
+    """
+    try:
+        if is_dir:
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except OSError as err:
+        return err
+
+    return None
+
+
+def prune(pattern: str,
+          older_than: datetime.datetime,
+          workers: int = 8,
+          dry_run: bool = True,
+          directories: bool = False) -> PruneResult:
+    """
+    Remove the files matching the pattern whose timestamp precedes the cutoff.
+
+    The pattern needs to contain the fields contiguously from the year to the least significant one
+    (*e.g.*, ``%Y/%m/%d/%H%M%S.jpg``). A file is removed if the start of the time span given by its match precedes
+    the cutoff, *i.e.*, the same files are removed as walked with ``walk(pattern, end=older_than)``.
+
+    The removals are performed concurrently while the file system is walked.
+
+    :param pattern: of the files
+    :param older_than: cutoff; the files starting at or after it are kept
+    :param workers: number of threads removing the files
+    :param dry_run: if set, nothing is removed, but the paths which would have been removed are reported
+    :param directories:
+        If set, the directories lying entirely before the cutoff (*e.g.*, a whole day of ``%Y/%m/%d``) are
+        removed as a unit instead of file by file. Mind that the *whole* directory is removed including the entries
+        which do not match the pattern. The directories matched by the pattern are removed as well.
+        If not set, only the files are removed and the directories are left in place.
+    :return: summary of the removal
+    """
+    if workers < 1:
+        raise ValueError("Expected workers >= 1, but got: {}".format(workers))
+
+    wlk = Walk(pattern=pattern, end=older_than, on_error='collect', path_type=str, collapse=directories)
+
+    result = PruneResult(dry_run=dry_run)
+
+    def targets() -> Iterator[Tuple[str, bool]]:
+        """Iterate over the paths to be removed and whether they are directories."""
+        for _, path, _, entry in wlk.entries():
+            is_dir = entry.is_dir
+            if is_dir and not directories:
+                continue
+
+            if dry_run:
+                result.paths.append(path)
+
+            yield path, is_dir
+
+    if dry_run:
+        outcomes = ((target, None) for target in targets())  # type: Iterable[Tuple[Any, Optional[OSError]]]
+    else:
+        outcomes = _execute_concurrently(func=_remove, args=targets(), workers=workers)
+
+    for (path, is_dir), err in outcomes:
+        if err is not None:
+            result.errors.append((path, err))
+        elif is_dir:
+            result.directories += 1
+        else:
+            result.files += 1
+
+    result.errors = wlk.errors + result.errors
+    return result
+
+
+RELAYOUT_MODES = ('rename', 'link')
+
+
+class RelayoutResult:
+    """Summarize the outcome of :py:func:`relayout`."""
+
+    def __init__(self) -> None:
+        """Initialize an empty summary."""
+        # number of renamed or linked files
+        self.files = 0
+
+        # number of created target directories
+        self.directories = 0
+
+        # errors encountered during the walk and the re-layout as (path, error); a ValueError denotes a source file
+        # which could not be rendered by the destination pattern
+        self.errors = []  # type: List[Tuple[str, Union[OSError, ValueError]]]
+
+    def __repr__(self) -> str:
+        """Represent the summary succinctly, but not ``eval``-able."""
+        return 'RelayoutResult(files={}, directories={}, errors={})'.format(
+            self.files, self.directories, len(self.errors))
+
+
+def _relocate(src: str, dst: str, mode: str) -> Optional[OSError]:
+    """
+    Rename or hard-link the file without replacing an existing target.
+
+    The file is renamed by linking it to the target and unlinking the source so that an existing target
+    can not be replaced, unlike with :py:func:`os.rename`. If the file system does not support hard links,
+    the file is renamed if the target does not exist yet.
+
+    :param src: path to the source file
+    :param dst: path to the target file
+    :param mode: 'rename' or 'link'
+    :return: error, if any; ``FileExistsError`` if the target exists
+    """
+    try:
+        if mode == 'link':
+            os.link(src, dst)
+            return None
+
+        try:
+            os.link(src, dst)
+        except FileExistsError:
+            raise
+        except OSError as err:
+            if os.path.lexists(dst):
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst) from err
+
+            os.rename(src, dst)
+        else:
+            os.unlink(src)
+
+    except OSError as err:
+        return err
+
+    return None
+
+
+def relayout(src_pattern: str, dst_pattern: str, workers: int = 8, mode: str = 'rename') -> RelayoutResult:
+    """
+    Move the files matching the source pattern to the paths rendered by the destination pattern.
+
+    The date/time fields of the destination are rendered from the match of the source (see :py:meth:`Matcher.format`)
+    and the wildcards of the destination take over the texts matched by the wildcards of the source in order of
+    appearance. For example, ``/src/%Y/%m/%d/%H/*.jpg`` can be re-laid out to ``/dst/%Y%m%d%H_*.jpg``.
+
+    The files are renamed or linked by a pool of threads while the source is walked. Each target directory
+    is created only once.
+
+    :param src_pattern: of the source files
+    :param dst_pattern: of the target files
+    :param workers: number of threads renaming or linking the files
+    :param mode: 'rename' to move the files, or 'link' to create hard links to the source files
+    :return:
+        summary of the re-layout; an existing target file is never replaced, but reported as an error
+        (*e.g.*, if the destination drops a field so that several source files render to the same target).
+        A source file which can not be rendered by the destination (*e.g.*, a year outside of 2000-2099 for ``%y``)
+        is skipped and reported as an error as well.
+    :raises:
+        ValueError if any of the patterns contains a recursive wildcard, if the destination requires date/time fields
+        or wildcards which the source does not provide, or if the parameters are invalid
+    """
+    # pylint: disable=too-many-locals
+    if workers < 1:
+        raise ValueError("Expected workers >= 1, but got: {}".format(workers))
+
+    if mode not in RELAYOUT_MODES:
+        raise ValueError("Expected mode to be one of {}, but got: {!r}".format(RELAYOUT_MODES, mode))
+
+    src_matcher = Matcher(pattern=src_pattern)
+    dst_matcher = Matcher(pattern=dst_pattern)
+
+    for matcher in [src_matcher, dst_matcher]:
+        if any(patseg.recursive for patseg in matcher.pattern_segments):
+            raise ValueError("Can not re-lay out a pattern with a recursive wildcard ('**'): {}".format(
+                matcher.pattern))
+
+    src_ranks = set(rank for patseg in src_matcher.pattern_segments for rank in _segment_ranks(patseg))
+    dst_ranks = set(rank for patseg in dst_matcher.pattern_segments for rank in _segment_ranks(patseg))
+    if not dst_ranks.issubset(src_ranks):
+        missing = [FIELD_NAMES[rank] for rank in sorted(dst_ranks - src_ranks)]
+        raise ValueError("The destination pattern {} requires the fields which the source pattern {} does not set: "
+                         "{}".format(dst_pattern, src_pattern, ', '.join(missing)))
+
+    src_wildcard_count, dst_wildcard_count = [
+        sum(patseg.wildcard_regex.groups for patseg in matcher.pattern_segments if patseg.wildcard_regex is not None)
+        for matcher in [src_matcher, dst_matcher]
+    ]
+
+    if src_wildcard_count != dst_wildcard_count:
+        raise ValueError("Expected the same number of wildcards in the source pattern {} and in the destination "
+                         "pattern {}, but got {} and {}, respectively".format(src_pattern, dst_pattern,
+                                                                              src_wildcard_count, dst_wildcard_count))
+
+    wlk = Walk(pattern=src_pattern, on_error='collect', path_type=str)
+    result = RelayoutResult()
+
+    # target directories which have been already created
+    created = set()  # type: Set[str]
+
+    def moves() -> Iterator[Tuple[str, str, str]]:
+        """Iterate over (source path, target path, mode) of the files and create the target directories."""
+        for mtch, src in wlk:
+            wildcards = []  # type: List[str]
+            if src_wildcard_count > 0:
+                segments = [segment for segment in src.split('/') if segment not in ('', '.')]
+                for segment, patseg in zip(segments, src_matcher.pattern_segments):
+                    if patseg.wildcard_regex is not None:
+                        wildcard_mtch = patseg.wildcard_regex.match(segment)
+                        assert wildcard_mtch is not None, "Expected the walked path to match: {}".format(src)
+                        wildcards.extend(wildcard_mtch.groups())
+
+            try:
+                dst = dst_matcher.format(mtch, wildcards=wildcards)
+            except ValueError as err:
+                # the file can not be rendered by the destination (e.g., the year is out of the range of '%y').
+                result.errors.append((src, err))
+                continue
+
+            directory = os.path.dirname(dst)
+            if directory != '' and directory not in created:
+                try:
+                    if not os.path.isdir(directory):
+                        os.makedirs(directory, exist_ok=True)
+                        result.directories += 1
+                except OSError as err:
+                    result.errors.append((directory, err))
+                    continue
+
+                created.add(directory)
+
+            yield src, dst, mode
+
+    for (src, _, _), err in _execute_concurrently(func=_relocate, args=moves(), workers=workers):
+        if err is not None:
+            result.errors.append((src, err))
+        else:
+            result.files += 1
+
+    result.errors[:0] = wlk.errors
+    return result
+
+
+def sample(pattern: str,
+           k: int,
+           start: Optional[datetime.datetime] = None,
+           end: Optional[datetime.datetime] = None,
+           seed: Optional[int] = None,
+           backend: Optional[Backend] = None) -> List[Tuple[Match, pathlib.Path]]:
+    """
+    Draw random files matching the pattern without walking the whole tree.
+
+    The files are drawn by random descents through the matching directories. Each descent chooses a sub-directory
+    with the probability proportional to the estimated number of the matching files below it, where the estimate
+    relies on the fan-outs observed in the directories listed so far. Hence only the directories on the drawn
+    paths are listed, and the sample is approximately uniform.
+
+    :param pattern: of the files
+    :param k: number of files to be drawn
+    :param start: if set, only the files with timestamps at or after the start are drawn
+    :param end: if set, only the files with timestamps before the end are drawn
+    :param seed: of the random number generator for a reproducible sample
+    :param backend: lists the directories; if not set, the local file system is listed
+    :return: distinct drawn files with their matches in the order of drawing; fewer than ``k`` if there are not
+        enough matching files
+    """
+    # pylint: disable=too-many-arguments
+    if k < 0:
+        raise ValueError("Expected k >= 0, but got: {}".format(k))
 
-                    stack.append((subpth, patsegs[1:], subpth_mtch))
+    wlk = Walk(pattern=pattern, start=start, end=end, backend=backend, on_error='skip')
+    drawn = wlk._sample(k=k, rand=random.Random(seed))  # pylint: disable=protected-access
+    return [(mtch, pathlib.Path(pth)) for mtch, pth in drawn]
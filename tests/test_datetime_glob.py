@@ -2,11 +2,19 @@
 
 # pylint: disable=missing-docstring
 # pylint: disable=invalid-name
+# pylint: disable=too-many-lines
 import datetime
+import io
+import os
 import pathlib
+import shutil
+import tarfile
 import tempfile
+import threading
+import time
 import unittest
-from typing import List, Optional, Tuple
+import zipfile
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 import datetime_glob
 
@@ -30,15 +38,50 @@ def match_equal(match: Optional[datetime_glob.Match], other: Optional[datetime_g
            match.microsecond == other.microsecond
 
 
+class RecordingBackend(datetime_glob.MemoryBackend):
+    """Record the listed directories and the maximum number of listings in progress at the same time."""
+
+    def __init__(self, files: Iterable[str], delay: float = 0.0) -> None:
+        super().__init__(files=files)
+        self.delay = delay
+        self.listed = []  # type: List[str]
+        self.max_in_progress = 0
+
+        self._in_progress = 0
+        self._lock = threading.Lock()
+
+    def list_directory(self, path: str) -> List[datetime_glob.Entry]:
+        with self._lock:
+            self.listed.append(path)
+            self._in_progress += 1
+            self.max_in_progress = max(self.max_in_progress, self._in_progress)
+
+        try:
+            if self.delay > 0:
+                time.sleep(self.delay)
+
+            return super().list_directory(path=path)
+        finally:
+            with self._lock:
+                self._in_progress -= 1
+
+
 class TestDatetimeGlob(unittest.TestCase):
     def test_parse_pattern_segment_invalid(self) -> None:
         with self.assertRaises(ValueError):
             _ = datetime_glob.parse_pattern_segment(pattern_segment='some text %1')
 
+        for pattern_segment in ['{a,}', 'cam{,01}', '[z-a]']:
+            with self.assertRaises(ValueError):
+                _ = datetime_glob.parse_pattern_segment(pattern_segment=pattern_segment)
+
     def test_parse_pattern_segment_as_text(self) -> None:
         # yapf: disable
         table = [
-            ('some -text_[x]', 'some -text_[x]'),
+            ('some -text_x', 'some -text_x'),
+            ('some -text_[x]', None),
+            ('{x}', '{x}'),
+            ('{x,y}', None),
             ('?', None),
             ('*a?b*', None),
             ('%d', None),
@@ -73,7 +116,10 @@ class TestDatetimeGlob(unittest.TestCase):
     def test_parse_pattern_segment(self) -> None:
         # yapf: disable
         table = [
-            ('some -text_[x]', None, {}),
+            ('some -text_[x]', '^some\\ \\-text_[x]$', {}),
+            ('[!a-c]', '^[^a-c]$', {}),
+            ('[]^]', '^[]\\^]$', {}),
+            ('cam{01,07}_%H', '^cam(?:01|07)_(0[0-9]|1[0-9]|2[0-3])$', {1: '%H'}),
             ('*', '^.*$', {}),
             ('?', '^.$', {}),
             ('*a?b*', '^.*a.b.*$', {}),
@@ -143,7 +189,8 @@ class TestDatetimeGlob(unittest.TestCase):
              datetime_glob.Match(2016, 1, 2, 3, 4, 5)),
             ('double year %y %Y', 'double year 18 2018', datetime_glob.Match(year=2018)),
             ('double year %y %Y', 'double year 17 2018', None),
-            ('invalid day %Y-%m-%d', 'invalid day 2018-02-31', None)
+            ('invalid day %Y-%m-%d', 'invalid day 2018-02-31', None),
+            ('year and month %Y-%m', 'year and month 2018-02', datetime_glob.Match(year=2018, month=2))
         ]
         # yapf: enable
 
@@ -344,6 +391,1259 @@ class TestDatetimeGlob(unittest.TestCase):
                                                (datetime.datetime(2016, 10, 4, 11, 12, 13), '2016-10-04/11-12-13.txt'),
                                                (datetime.datetime(2016, 10, 5, 1, 2, 3), '2016-10-05/01-02-03.txt')])
 
+    def test_walk_sharded(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            expected = []  # type: List[str]
+            for day in range(1, 29):
+                for hour in (0, 12):
+                    pth = tmppth / '2016-02-{:02d}'.format(day) / '{:02d}-00-00.txt'.format(hour)
+                    pth.parent.mkdir(exist_ok=True, parents=True)
+                    pth.write_text('tested')
+                    expected.append(pth.relative_to(tmppth).as_posix())
+
+            pattern = tempdir + "/%Y-%m-%d/%H-%M-%S.txt"
+
+            shards = []  # type: List[List[str]]
+            for shard_index in range(3):
+                shards.append(
+                    sorted(
+                        pth.relative_to(tmppth).as_posix() for _, pth in datetime_glob.walk(
+                            pattern=pattern, shard_index=shard_index, shard_count=3)))
+
+            # shards are disjoint and cover the whole tree
+            self.assertListEqual(sorted(pth for shard in shards for pth in shard), sorted(expected))
+            for shard in shards:
+                self.assertGreater(len(shard), 0)
+
+            # the directory level is not split among the shards
+            for shard in shards:
+                for other in shards:
+                    if shard is not other:
+                        self.assertEqual(
+                            set(pth.split('/')[0] for pth in shard) & set(pth.split('/')[0] for pth in other), set())
+
+            # shards at the leaf level
+            leaf_shards = [
+                sorted(
+                    pth.relative_to(tmppth).as_posix() for _, pth in datetime_glob.walk(
+                        pattern=pattern, shard_index=shard_index, shard_count=3, shard_level=1))
+                for shard_index in range(3)
+            ]
+            self.assertListEqual(sorted(pth for shard in leaf_shards for pth in shard), sorted(expected))
+
+            with self.assertRaises(ValueError):
+                _ = list(datetime_glob.walk(pattern=pattern, shard_index=3, shard_count=3))
+
+            with self.assertRaises(ValueError):
+                _ = list(datetime_glob.walk(pattern=pattern, shard_index=0))
+
+    def test_walk_resume_from_cursor(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            expected = []  # type: List[str]
+            for day in range(1, 6):
+                for hour in (0, 12):
+                    pth = tmppth / '2016-02-{:02d}'.format(day) / '{:02d}-00-00.txt'.format(hour)
+                    pth.parent.mkdir(exist_ok=True, parents=True)
+                    pth.write_text('tested')
+                    expected.append(pth.as_posix())
+
+            pattern = tempdir + "/%Y-%m-%d/%H-%M-%S.txt"
+
+            # the walk is deterministic
+            self.assertListEqual([pth.as_posix() for _, pth in datetime_glob.walk(pattern=pattern)], expected)
+
+            for interrupt_at in range(len(expected) + 1):
+                wlk = datetime_glob.walk(pattern=pattern)
+                got = [pth.as_posix() for _, (_, pth) in zip(range(interrupt_at), wlk)]
+
+                cursor = datetime_glob.Cursor.from_json(wlk.cursor.to_json())
+                got.extend(pth.as_posix() for _, pth in datetime_glob.walk(pattern=pattern, cursor=cursor))
+
+                self.assertListEqual(got, expected, "interrupted at {}".format(interrupt_at))
+
+            # deadline
+            wlk = datetime_glob.walk(pattern=pattern, deadline=time.time() - 1.0)
+            self.assertListEqual(list(wlk), [])
+            self.assertTrue(wlk.timed_out)
+            self.assertFalse(wlk.cursor.done())
+
+            resumed = [pth.as_posix() for _, pth in datetime_glob.walk(pattern=pattern, cursor=wlk.cursor)]
+            self.assertListEqual(resumed, expected)
+
+            with self.assertRaises(ValueError):
+                _ = datetime_glob.walk(pattern=tempdir + "/%Y/%m-%d/%H-%M-%S.txt", cursor=wlk.cursor)
+
+    def test_walk_on_error(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            for day in range(1, 4):
+                pth = tmppth / '2016-02-{:02d}'.format(day) / '00-00-00.txt'
+                pth.parent.mkdir(exist_ok=True, parents=True)
+                pth.write_text('tested')
+
+            pattern = tempdir + "/%Y-%m-%d/%H-%M-%S.txt"
+
+            # the directory vanishes after it has been seen by the walk
+            for on_error in ['raise', 'skip', 'collect']:
+                wlk = datetime_glob.walk(pattern=pattern, on_error=on_error)
+                _, first = next(wlk)
+
+                vanished = tmppth / '2016-02-02'
+                shutil.rmtree(str(vanished))
+
+                if on_error == 'raise':
+                    with self.assertRaises(FileNotFoundError):
+                        _ = list(wlk)
+                else:
+                    rest = [pth for _, pth in wlk]
+                    self.assertListEqual([first] + rest, [
+                        tmppth / '2016-02-01' / '00-00-00.txt',
+                        tmppth / '2016-02-03' / '00-00-00.txt',
+                    ])
+
+                    if on_error == 'collect':
+                        self.assertEqual(len(wlk.errors), 1)
+                        self.assertEqual(wlk.errors[0][0], vanished.as_posix())
+                        self.assertIsInstance(wlk.errors[0][1], FileNotFoundError)
+                    else:
+                        self.assertListEqual(wlk.errors, [])
+
+                (vanished / '00-00-00.txt').parent.mkdir()
+                (vanished / '00-00-00.txt').write_text('tested')
+
+    def test_matcher_recursive_wildcard(self) -> None:
+        # yapf: disable
+        table = [
+            ('/data/**/%Y/%m/%d/*.jpg', '/data/2016/07/03/a.jpg', datetime_glob.Match(2016, 7, 3)),
+            ('/data/**/%Y/%m/%d/*.jpg', '/data/site/cam/2016/07/03/a.jpg', datetime_glob.Match(2016, 7, 3)),
+            ('/data/**/%Y/%m/%d/*.jpg', '/data/site/cam/2016/07/03', None),
+            ('/data/**/%Y/%m/%d/*.jpg', '/other/site/cam/2016/07/03/a.jpg', None),
+            ('/data/**/%Y/**/%m-%d.jpg', '/data/a/2016/b/c/07-03.jpg', datetime_glob.Match(2016, 7, 3)),
+            ('/data/**/%Y/**/%m-%d.jpg', '/data/2016/07-03.jpg', datetime_glob.Match(2016, 7, 3)),
+            ('/data/**/%Y/**/%m-%d.jpg', '/data/a/b/07-03.jpg', None),
+            ('/data/%Y/**', '/data/2016/a/b', datetime_glob.Match(year=2016)),
+            ('/data/%Y/**', '/data/2016', datetime_glob.Match(year=2016)),
+            ('/data/**/**/%Y', '/data/a/b/c/2016', datetime_glob.Match(year=2016)),
+            ('/data/a**b', '/data/a-b', datetime_glob.Match()),
+            ('/data/a**b', '/data/a/b', None),
+        ]
+        # yapf: enable
+
+        for pattern, path, expected in table:
+            mtch = datetime_glob.Matcher(pattern=pattern).match(path=path)
+            self.assertTrue(
+                match_equal(match=mtch, other=expected), "for pattern {!r} and path {!r}, got: {}, expected: {}".format(
+                    pattern, path, mtch, expected))
+
+        patseg = datetime_glob.parse_pattern_segment(pattern_segment='**')
+        self.assertTrue(patseg.recursive)
+
+        patseg = datetime_glob.parse_pattern_segment(pattern_segment='a**')
+        self.assertFalse(patseg.recursive)
+
+    def test_walk_recursive_wildcard(self) -> None:
+        # pylint: disable=too-many-locals
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            relative_pths = [
+                '2016/07/03/a.jpg',
+                'site1/cam1/2016/07/04/b.jpg',
+                'site1/cam1/2016/07/04/b.txt',
+                'site1/2016/07/05/c.jpg',
+                'site2/cam2/x/2016/07/06/d.jpg',
+                'site2/cam2/x/2016/07/unmatched.jpg',
+            ]
+
+            for relative_pth in relative_pths:
+                pth = tmppth / relative_pth
+                pth.parent.mkdir(exist_ok=True, parents=True)
+                pth.write_text('tested')
+
+            mtches_pths = list(datetime_glob.walk(pattern=tempdir + '/**/%Y/%m/%d/*.jpg'))
+            self.assertListEqual([(mtch.as_date(), pth.relative_to(tmppth).as_posix()) for mtch, pth in mtches_pths],
+                                 [(datetime.date(2016, 7, 3), '2016/07/03/a.jpg'),
+                                  (datetime.date(2016, 7, 5), 'site1/2016/07/05/c.jpg'),
+                                  (datetime.date(2016, 7, 4), 'site1/cam1/2016/07/04/b.jpg'),
+                                  (datetime.date(2016, 7, 6), 'site2/cam2/x/2016/07/06/d.jpg')])
+
+            # multiple recursive wildcards yield each path only once
+            pths = [
+                pth.relative_to(tmppth).as_posix() for _, pth in datetime_glob.walk(pattern=tempdir + '/**/**/*.jpg')
+            ]
+            self.assertListEqual(sorted(pths), sorted(pth for pth in relative_pths if pth.endswith('.jpg')))
+
+            # sharding splits the recursive walk as well
+            sharded = sorted(
+                pth.relative_to(tmppth).as_posix() for shard_index in range(3) for _, pth in datetime_glob.walk(
+                    pattern=tempdir + '/**/%Y/%m/%d/*.jpg', shard_index=shard_index, shard_count=3))
+            self.assertListEqual(sharded, sorted(pth.relative_to(tmppth).as_posix() for _, pth in mtches_pths))
+
+            matcher = datetime_glob.Matcher(pattern=tempdir + '/**/%Y/%m/%d/*.jpg')
+            for mtch, pth in mtches_pths:
+                self.assertTrue(match_equal(match=matcher.match(pth), other=mtch))
+
+            # the recursive wildcard does not follow the links to directories, including the cyclic ones
+            (tmppth / 'site1' / 'up').symlink_to('..')
+            (tmppth / 'site3').symlink_to(tmppth / 'site2')
+            self.assertListEqual([pth for _, pth in datetime_glob.walk(pattern=tempdir + '/**/%Y/%m/%d/*.jpg')],
+                                 [pth for _, pth in mtches_pths])
+
+        backend = RecordingBackend(files=['/data/' + relative_pth for relative_pth in relative_pths])
+        pattern = '/data/**/%Y/%m/%d/*.jpg'
+        pths = [pth for _, pth in datetime_glob.walk(pattern=pattern, backend=backend, path_type=str)]
+        self.assertListEqual(pths, [
+            '/data/2016/07/03/a.jpg', '/data/site1/2016/07/05/c.jpg', '/data/site1/cam1/2016/07/04/b.jpg',
+            '/data/site2/cam2/x/2016/07/06/d.jpg'
+        ])
+
+        # each directory is listed once, although the directories below the year are matched in two ways
+        self.assertEqual(len(backend.listed), len(set(backend.listed)))
+
+        wlk = datetime_glob.walk(pattern=pattern, backend=backend, path_type=str)
+        first_pths = [next(wlk)[1], next(wlk)[1]]
+        cursor = datetime_glob.Cursor.from_json(wlk.cursor.to_json())
+        wlk.close()
+
+        resumed_pths = [pth for _, pth in datetime_glob.walk(pattern=pattern, backend=backend, path_type=str,
+                                                             cursor=cursor)]
+        self.assertListEqual(first_pths + resumed_pths, pths)
+
+    def test_walk_exclude(self) -> None:
+        backend = RecordingBackend(files=[
+            '/data/site1/2016/07/03/a.jpg',
+            '/data/site1/2016/07/03/b.jpg.tmp',
+            '/data/site1/2016/07/04_incomplete/c.jpg',
+            '/data/site1/2016/07/05/d.jpg',
+            '/data/quarantine/2016/07/03/e.jpg',
+            '/data/site2/2016/07/03/f.jpg',
+        ])
+
+        pths = [
+            pth.as_posix() for _, pth in datetime_glob.walk(
+                pattern='/data/**/%Y/%m/*/*',
+                backend=backend,
+                exclude=['*.tmp', '*_incomplete', 'quarantine', '/data/site2/%Y'])
+        ]
+
+        self.assertListEqual(pths, ['/data/site1/2016/07/03/a.jpg', '/data/site1/2016/07/05/d.jpg'])
+
+        # the excluded directories have not been listed
+        for excluded in ['/data/quarantine', '/data/site1/2016/07/04_incomplete', '/data/site2/2016']:
+            self.assertNotIn(excluded, backend.listed)
+
+        with self.assertRaises(ValueError):
+            _ = datetime_glob.walk(pattern='/data/%Y/*', exclude=['relative/%Y'])
+
+    def test_walk_path_type(self) -> None:
+        backend = datetime_glob.MemoryBackend(files=['/data/2016/07/03/a.jpg', '/data/2016/07/04/b.jpg'])
+        pattern = '/data/%Y/%m/%d/*.jpg'
+
+        strs = [pth for _, pth in datetime_glob.walk(pattern=pattern, backend=backend, path_type=str)]
+        self.assertListEqual(strs, ['/data/2016/07/03/a.jpg', '/data/2016/07/04/b.jpg'])
+
+        byts = [pth for _, pth in datetime_glob.walk(pattern=pattern, backend=backend, path_type=bytes)]
+        self.assertListEqual(byts, [b'/data/2016/07/03/a.jpg', b'/data/2016/07/04/b.jpg'])
+
+        pths = [pth for _, pth in datetime_glob.walk(pattern=pattern, backend=backend)]
+        self.assertListEqual(pths, [pathlib.Path('/data/2016/07/03/a.jpg'), pathlib.Path('/data/2016/07/04/b.jpg')])
+
+        mtch = datetime_glob.Matcher(pattern=pattern).match(b'/data/2016/07/03/a.jpg')
+        self.assertTrue(match_equal(mtch, datetime_glob.Match(year=2016, month=7, day=3)))
+
+        with self.assertRaises(ValueError):
+            _ = datetime_glob.walk(pattern=pattern, path_type=int)
+
+
+class TestCalendar(unittest.TestCase):
+    def test_matcher(self) -> None:
+        # yapf: disable
+        table = [
+            ('/%Y/%m/%d.txt', '/2016/02/29.txt', datetime_glob.Match(2016, 2, 29)),
+            ('/%Y/%m/%d.txt', '/2015/02/29.txt', None),
+            ('/%Y/%m/%d.txt', '/2016/02/30.txt', None),
+            ('/%Y/%m/%d.txt', '/2016/04/31.txt', None),
+            ('/%Y/%m/%d.txt', '/1900/02/29.txt', None),
+            ('/%Y/%m/%d.txt', '/2000/02/29.txt', datetime_glob.Match(2000, 2, 29)),
+            ('/%m-%d/%Y.txt', '/02-29/2016.txt', datetime_glob.Match(2016, 2, 29)),
+            ('/%m-%d/%Y.txt', '/02-29/2017.txt', None),
+            ('/%m-%d.txt', '/02-29.txt', datetime_glob.Match(month=2, day=29)),
+            ('/%m-%d.txt', '/02-30.txt', None),
+            ('/%d/%m/%Y.txt', '/31/06/2016.txt', None),
+            ('/%d/%Y/%m.txt', '/29/2017/02.txt', None),
+            ('/%d/%Y/%m.txt', '/29/2016/02.txt', datetime_glob.Match(2016, 2, 29)),
+        ]
+        # yapf: enable
+
+        for pattern, path, expected in table:
+            mtch = datetime_glob.Matcher(pattern=pattern).match(path=path)
+            self.assertTrue(
+                match_equal(match=mtch, other=expected), "for pattern {!r} and path {!r}, got: {}, expected: {}".format(
+                    pattern, path, mtch, expected))
+
+    def test_walk_prunes_impossible_dates(self) -> None:
+        backend = RecordingBackend(files=[
+            '/data/2016/02/28/a.jpg',
+            '/data/2016/02/29/b.jpg',
+            '/data/2016/02/30/c.jpg',
+            '/data/2016/02/31/d.jpg',
+            '/data/2017/02/29/e.jpg',
+        ])
+
+        pths = [pth for _, pth in datetime_glob.walk(pattern='/data/%Y/%m/%d/*.jpg', backend=backend, path_type=str)]
+        self.assertListEqual(pths, ['/data/2016/02/28/a.jpg', '/data/2016/02/29/b.jpg'])
+
+        for impossible in ['/data/2016/02/30', '/data/2016/02/31', '/data/2017/02/29']:
+            self.assertNotIn(impossible, backend.listed)
+
+
+class TestRange(unittest.TestCase):
+    def test_order_preserving(self) -> None:
+        # yapf: disable
+        table = [
+            ('%Y%m%dT%H%M%S', True),
+            ('img-%Y-%m-%d.jpg', True),
+            ('%Y%Y%m', True),
+            ('text', True),
+            ('%Y%m%dT%H%M%S*', False),
+            ('%Y-%-m-%d', False),
+            ('%d-%m-%Y', False),
+            ('*', False),
+            ('**', False)
+        ]
+        # yapf: enable
+
+        for pattern_segment, expected in table:
+            patseg = datetime_glob.parse_pattern_segment(pattern_segment=pattern_segment)
+            self.assertEqual(patseg.order_preserving, expected, pattern_segment)
+
+        self.assertTrue(datetime_glob.Matcher(pattern='/some/%Y/%m/%d/%H%M%S.jpg').order_preserving)
+        self.assertFalse(datetime_glob.Matcher(pattern='/some/%d/%m/%Y.jpg').order_preserving)
+        self.assertFalse(datetime_glob.Matcher(pattern='/some/*/%Y/%m/%d.jpg').order_preserving)
+
+    def test_select_range(self) -> None:
+        start = datetime.datetime(2016, 2, 27, 23, 0, 0)
+        dtimes = [start + datetime.timedelta(minutes=17 * i) for i in range(100)]
+
+        matcher = datetime_glob.Matcher(pattern='%Y%m%dT%H%M%S.jpg')
+        names = sorted([dtime.strftime('%Y%m%dT%H%M%S.jpg') for dtime in dtimes] + ['unmatched.jpg', '2016.txt'])
+
+        # yapf: disable
+        ranges = [
+            (None, None),
+            (datetime.datetime(2016, 2, 28), datetime.datetime(2016, 2, 29)),
+            (dtimes[3], dtimes[10]),
+            (dtimes[3] + datetime.timedelta(seconds=1), dtimes[10] + datetime.timedelta(microseconds=1)),
+            (datetime.datetime(2017, 1, 1), None),
+            (None, datetime.datetime(2016, 1, 1))
+        ]
+        # yapf: enable
+
+        for range_start, range_end in ranges:
+            selected = matcher.select_range(sorted_names=names, start=range_start, end=range_end)
+
+            expected = [
+                dtime for dtime in dtimes
+                if (range_start is None or range_start <= dtime) and (range_end is None or dtime < range_end)
+            ]
+
+            self.assertListEqual([mtch.as_datetime() for mtch, _ in selected], expected)
+            self.assertListEqual([name for _, name in selected],
+                                 [dtime.strftime('%Y%m%dT%H%M%S.jpg') for dtime in expected])
+
+        with self.assertRaises(ValueError):
+            _ = datetime_glob.Matcher(pattern='%d.%m.%Y.jpg').select_range(sorted_names=[], start=None, end=None)
+
+    def test_walk_range(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            start = datetime.datetime(2016, 12, 30, 22, 0, 0)
+            dtimes = [start + datetime.timedelta(minutes=37 * i) for i in range(200)]
+
+            for dtime in dtimes:
+                for relative_pth in [
+                        dtime.strftime('ordered/%Y/%m/%d/%H%M%S.txt'),
+                        dtime.strftime('unordered/%y/%-m/%-d/%H-%M-%S.txt')
+                ]:
+                    pth = tmppth / relative_pth
+                    pth.parent.mkdir(exist_ok=True, parents=True)
+                    pth.write_text('tested')
+
+            # yapf: disable
+            ranges = [
+                (None, None),
+                (datetime.datetime(2016, 12, 31), datetime.datetime(2017, 1, 2)),
+                (dtimes[30], dtimes[150]),
+                (dtimes[30] + datetime.timedelta(seconds=1), dtimes[150] + datetime.timedelta(microseconds=1)),
+                (datetime.datetime(2017, 1, 1, 12, 30), None),
+                (None, datetime.datetime(2016, 12, 31, 5, 1)),
+                (datetime.datetime(2018, 1, 1), None),
+                (datetime.datetime(1999, 1, 1), datetime.datetime(2017, 1, 1))
+            ]
+            # yapf: enable
+
+            for pattern in ['ordered/%Y/%m/%d/%H%M%S.txt', 'unordered/%y/%-m/%-d/%H-%M-%S.txt']:
+                for range_start, range_end in ranges:
+                    expected = [
+                        dtime for dtime in dtimes
+                        if (range_start is None or range_start <= dtime) and (range_end is None or dtime < range_end)
+                    ]
+
+                    got = sorted(
+                        mtch.as_datetime() for mtch, _ in datetime_glob.walk(
+                            pattern=tempdir + '/' + pattern, start=range_start, end=range_end))
+
+                    self.assertListEqual(got, expected, "pattern: {}, range: {} - {}".format(
+                        pattern, range_start, range_end))
+
+            with self.assertRaises(ValueError):
+                _ = datetime_glob.walk(pattern=tempdir + '/%Y/%d.txt', start=datetime.datetime(2016, 1, 1))
+
+    def test_walk_stop_at_level(self) -> None:
+        backend = RecordingBackend(files=[
+            '/data/2016/07/02/a.jpg',
+            '/data/2016/07/03/b.jpg',
+            '/data/2016/07/03/c.jpg',
+            '/data/2016/07/04/d.jpg',
+            '/data/2016/07/05.jpg',
+        ])
+
+        pattern = '/data/%Y/%m/%d/*.jpg'
+
+        mtches_pths = list(datetime_glob.walk(pattern=pattern, stop_at_level=4, backend=backend, path_type=str))
+        self.assertListEqual([(mtch.as_date(), pth) for mtch, pth in mtches_pths],
+                             [(datetime.date(2016, 7, 2), '/data/2016/07/02'),
+                              (datetime.date(2016, 7, 3), '/data/2016/07/03'),
+                              (datetime.date(2016, 7, 4), '/data/2016/07/04')])
+
+        # the day directories have not been listed
+        self.assertListEqual(backend.listed, ['/data', '/data/2016', '/data/2016/07'])
+
+        mtches_pths = list(
+            datetime_glob.walk(
+                pattern=pattern,
+                stop_at_level=3,
+                backend=backend,
+                path_type=str,
+                start=datetime.datetime(2016, 7, 3, 12),
+                end=datetime.datetime(2016, 7, 4, 12)))
+        self.assertListEqual([(mtch.year, mtch.month, pth) for mtch, pth in mtches_pths], [(2016, 7, '/data/2016/07')])
+
+        mtches_pths = list(
+            datetime_glob.walk(
+                pattern=pattern,
+                stop_at_level=4,
+                backend=backend,
+                path_type=str,
+                start=datetime.datetime(2016, 7, 3, 12),
+                end=datetime.datetime(2016, 7, 4, 12)))
+        self.assertListEqual([pth for _, pth in mtches_pths], ['/data/2016/07/03', '/data/2016/07/04'])
+
+        for stop_at_level in [1, 6]:
+            with self.assertRaises(ValueError):
+                _ = datetime_glob.walk(pattern=pattern, stop_at_level=stop_at_level)
+
+
+class TestBackend(unittest.TestCase):
+    def test_memory_backend(self) -> None:
+        backend = datetime_glob.MemoryBackend(files=[
+            '/data/2016-10-03/21-22-23.txt',
+            '/data/2016-10-03/unmatched.txt',
+            '/data/2016-10-04/11-12-13.txt',
+            '/data//./2016-10-05/01-02-03.txt',
+            '/data/some-dummy-file',
+        ])
+        backend.add_directory('/data/2016-10-06')
+
+        self.assertListEqual(
+            sorted((entry.name, entry.is_dir) for entry in backend.list_directory('/data')),
+            [('2016-10-03', True), ('2016-10-04', True), ('2016-10-05', True), ('2016-10-06', True),
+             ('some-dummy-file', False)])
+
+        with self.assertRaises(FileNotFoundError):
+            _ = backend.list_directory('/nonexisting')
+
+        with self.assertRaises(NotADirectoryError):
+            _ = backend.list_directory('/data/some-dummy-file')
+
+        with self.assertRaises(IsADirectoryError):
+            backend.add_file('/data/2016-10-06')
+
+        mtches_pths = list(datetime_glob.walk(pattern='/data/%Y-%m-%d/%H-%M-%S.txt', backend=backend))
+        self.assertListEqual([(mtch.as_datetime(), pth.as_posix()) for mtch, pth in mtches_pths],
+                             [(datetime.datetime(2016, 10, 3, 21, 22, 23), '/data/2016-10-03/21-22-23.txt'),
+                              (datetime.datetime(2016, 10, 4, 11, 12, 13), '/data/2016-10-04/11-12-13.txt'),
+                              (datetime.datetime(2016, 10, 5, 1, 2, 3), '/data/2016-10-05/01-02-03.txt')])
+
+        relative_backend = datetime_glob.MemoryBackend(files=['2016/a.txt', 'other/2017/b.txt'])
+        self.assertListEqual(
+            [pth.as_posix() for _, pth in datetime_glob.walk(pattern='**/%Y/*.txt', backend=relative_backend)],
+            ['2016/a.txt', 'other/2017/b.txt'])
+
+    def test_local_backend_paged_with_read_ahead(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            expected = []  # type: List[str]
+            for day in range(1, 11):
+                for hour in range(3):
+                    pth = tmppth / '2016-02-{:02d}'.format(day) / '{:02d}-00-00.txt'.format(hour)
+                    pth.parent.mkdir(exist_ok=True, parents=True)
+                    pth.write_text('tested')
+                    expected.append(pth.as_posix())
+
+            backend = datetime_glob.LocalBackend(page_size=2)
+            self.assertListEqual([len(page) for page in backend.list_pages(tempdir + '/2016-02-01')], [2, 1])
+
+            for read_ahead in [0, 1, 4]:
+                wlk = datetime_glob.walk(pattern=tempdir + "/%Y-%m-%d/%H-%M-%S.txt", backend=backend,
+                                         read_ahead=read_ahead)
+                self.assertListEqual([pth.as_posix() for _, pth in wlk], expected)
+
+            # the walk can be closed before it finishes
+            wlk = datetime_glob.walk(pattern=tempdir + "/%Y-%m-%d/%H-%M-%S.txt", read_ahead=2)
+            _ = next(wlk)
+            wlk.close()
+            self.assertListEqual(list(wlk), [])
+
+    def test_walk_with_stat(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            for day in range(1, 4):
+                pth = tmppth / '2016-02-{:02d}'.format(day) / '00-00-00.txt'
+                pth.parent.mkdir(exist_ok=True, parents=True)
+                pth.write_text('x' * day)
+
+            results = list(datetime_glob.walk(pattern=tempdir + "/%Y-%m-%d/%H-%M-%S.txt", with_stat=True).with_stats())
+            self.assertEqual(len(results), 3)
+
+            for mtch, pth, stat in results:
+                stat_result = pth.stat()
+                self.assertEqual(stat.size, mtch.day)
+                self.assertEqual(stat.size, stat_result.st_size)
+                self.assertEqual(stat.mtime, stat_result.st_mtime)
+                self.assertEqual(stat.inode, stat_result.st_ino)
+
+        backend = datetime_glob.MemoryBackend()
+        backend.add_file('/data/2016/a.txt', stat=datetime_glob.FileStat(size=10, mtime=123.0, inode=7))
+        results = list(datetime_glob.walk(pattern='/data/%Y/*.txt', backend=backend, with_stat=True).with_stats())
+        self.assertEqual(len(results), 1)
+
+        mtch, pth, stat = results[0]
+        self.assertEqual(pth, pathlib.Path('/data/2016/a.txt'))
+        self.assertEqual((stat.size, stat.mtime, stat.inode), (10, 123.0, 7))
+
+        # the plain iteration returns (match, path) even if the walk is performed with the metadata
+        mtches_pths = list(datetime_glob.walk(pattern='/data/%Y/*.txt', backend=backend, with_stat=True))
+        self.assertListEqual([pth for _, pth in mtches_pths], [pathlib.Path('/data/2016/a.txt')])
+
+        with self.assertRaises(ValueError):
+            list(datetime_glob.walk(pattern='/data/%Y/*.txt', backend=backend).with_stats())
+
+    def test_lazy_entry_type(self) -> None:
+        resolved = []  # type: List[str]
+
+        class Handle:
+            def __init__(self, path: str, is_dir: bool) -> None:
+                self.path = path
+                self.is_dir_value = is_dir
+
+            def is_dir(self) -> bool:
+                resolved.append(self.path)
+                return self.is_dir_value
+
+        class LazyBackend(datetime_glob.MemoryBackend):
+            def list_directory(self, path: str) -> List[datetime_glob.Entry]:
+                return [
+                    datetime_glob.Entry(name=entry.name, handle=Handle(path=path + '/' + entry.name,
+                                                                       is_dir=entry.is_dir))
+                    for entry in super().list_directory(path=path)
+                ]
+
+        backend = LazyBackend(files=['/data/2016/a.jpg', '/data/2016/b.txt', '/data/2017/c.jpg', '/data/other/d.jpg'])
+
+        pths = [pth for _, pth in datetime_glob.walk(pattern='/data/%Y/*.jpg', backend=backend, path_type=str)]
+        self.assertListEqual(pths, ['/data/2016/a.jpg', '/data/2017/c.jpg'])
+
+        # only the matching entries of the directory level needed their type
+        self.assertListEqual(resolved, ['/data/2016', '/data/2017'])
+
+        entry = datetime_glob.Entry(name='2016', handle=Handle(path='/data/2016', is_dir=True))
+        self.assertTrue(entry.is_dir)
+        self.assertTrue(entry.is_dir)
+        self.assertEqual(resolved.count('/data/2016'), 2)
+
+    def test_lookup_alternatives(self) -> None:
+        backend = RecordingBackend(files=[
+            '/data/cam01/2016/a.jpg',
+            '/data/cam02/2016/b.jpg',
+            '/data/cam07/2016/c.jpg',
+            '/data/cam07/2016/d.png',
+            '/data/cam12/2016/e.jpg',
+        ])
+
+        pattern = '/data/cam{01,07,99}/%Y/[a-d].{jpg,png}'
+        self.assertEqual(
+            datetime_glob.parse_pattern_as_prefix_segments(pattern)[1][0].candidates, ['cam01', 'cam07', 'cam99'])
+
+        pths = [pth for _, pth in datetime_glob.walk(pattern=pattern, backend=backend, path_type=str)]
+        self.assertListEqual(pths, ['/data/cam01/2016/a.jpg', '/data/cam07/2016/c.jpg', '/data/cam07/2016/d.png'])
+
+        # the candidate directories have been looked up without listing their parent
+        self.assertNotIn('/data', backend.listed)
+
+        matcher = datetime_glob.Matcher(pattern=pattern)
+        self.assertIsNotNone(matcher.match('/data/cam99/2016/b.png'))
+        self.assertIsNone(matcher.match('/data/cam02/2016/b.png'))
+        self.assertIsNone(matcher.match('/data/cam01/2016/e.jpg'))
+
+        self.assertEqual(datetime_glob.plan(pattern=pattern, sample_size=0).levels[0].kind, 'lookup')
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+            for relative_pth in ['cam01/2016/a.jpg', 'cam02/2016/b.jpg', 'cam07/2016/d.png']:
+                pth = tmppth / relative_pth
+                pth.parent.mkdir(parents=True, exist_ok=True)
+                pth.write_text('tested')
+
+            wlk = datetime_glob.walk(pattern=tmppth.as_posix() + '/cam{01,07,99}/%Y/*.{jpg,png}', with_stat=True)
+            mtches_pths_stats = list(wlk.with_stats())
+            self.assertListEqual([(pth.relative_to(tmppth).as_posix(), stat.size)
+                                  for _, pth, stat in mtches_pths_stats], [('cam01/2016/a.jpg', 6),
+                                                                            ('cam07/2016/d.png', 6)])
+
+
+class TestListingCache(unittest.TestCase):
+    def test_memory_backend(self) -> None:
+        backend = datetime_glob.MemoryBackend(files=['/data/2016/07/03/a.jpg', '/data/2016/07/04/b.jpg'])
+        cache = datetime_glob.ListingCache(backend=backend, max_entries=3, ttl=None)
+
+        pattern = '/data/%Y/%m/%d/*.jpg'
+        expected = ['/data/2016/07/03/a.jpg', '/data/2016/07/04/b.jpg']
+
+        self.assertListEqual([pth for _, pth in datetime_glob.walk(pattern, backend=cache, path_type=str)], expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 5))
+
+        # only the three most recently used listings have been kept
+        self.assertEqual(len(cache), 3)
+
+        self.assertListEqual([pth for _, pth in datetime_glob.walk(pattern, backend=cache, path_type=str)], expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 10))
+
+        backend.add_file('/data/2016/07/04/c.jpg')
+        self.assertListEqual(
+            [entry.name for entry in cache.list_directory('/data/2016/07/04')], ['b.jpg'], 'Expected a stale listing')
+        self.assertEqual((cache.hits, cache.misses), (1, 10))
+
+        cache.invalidate('/data/2016/07/04')
+        self.assertListEqual(sorted(entry.name for entry in cache.list_directory('/data/2016/07/04')),
+                             ['b.jpg', 'c.jpg'])
+
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+        with self.assertRaises(ValueError):
+            _ = datetime_glob.ListingCache(max_entries=0)
+
+    def test_lazy_entry_type(self) -> None:
+        resolved = []  # type: List[str]
+
+        class Handle:
+            def __init__(self, path: str, is_dir: bool) -> None:
+                self.path = path
+                self.is_dir_value = is_dir
+
+            def is_dir(self) -> bool:
+                resolved.append(self.path)
+                return self.is_dir_value
+
+            def is_symlink(self) -> bool:
+                resolved.append(self.path)
+                return False
+
+        class LazyBackend(datetime_glob.MemoryBackend):
+            def list_directory(self, path: str) -> List[datetime_glob.Entry]:
+                return [
+                    datetime_glob.Entry(name=entry.name,
+                                        handle=Handle(path=path + '/' + entry.name, is_dir=entry.is_dir),
+                                        is_symlink=None) for entry in super().list_directory(path=path)
+                ]
+
+        files = ['/data/2016/{:03d}.jpg'.format(i) for i in range(100)]
+        cache = datetime_glob.ListingCache(backend=LazyBackend(files=files), ttl=None)
+
+        for _ in range(2):
+            pths = [pth for _, pth in datetime_glob.walk(pattern='/data/%Y/*.jpg', backend=cache, path_type=str)]
+            self.assertListEqual(pths, files)
+
+        # only the directory needed its type and it has been resolved once for all the walks
+        self.assertListEqual(resolved, ['/data/2016'])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        # the handles are not exposed through the cache
+        for entry in cache.list_directory('/data/2016'):
+            self.assertFalse(hasattr(entry.handle, 'stat'))
+            self.assertFalse(entry.is_symlink)
+
+    def test_ttl_and_mtime(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+            (tmppth / 'a.txt').write_text('tested')
+
+            cache = datetime_glob.ListingCache(ttl=0.05)
+            self.assertListEqual([entry.name for entry in cache.list_directory(tempdir)], ['a.txt'])
+            self.assertListEqual([entry.name for entry in cache.list_directory(tempdir)], ['a.txt'])
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            time.sleep(0.1)
+            self.assertListEqual([entry.name for entry in cache.list_directory(tempdir)], ['a.txt'])
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+            validated_cache = datetime_glob.ListingCache(ttl=None, validate_mtime=True)
+            self.assertListEqual([entry.name for entry in validated_cache.list_directory(tempdir)], ['a.txt'])
+
+            (tmppth / 'b.txt').write_text('tested')
+            os.utime(tempdir, (0, 0))
+            self.assertListEqual(sorted(entry.name for entry in validated_cache.list_directory(tempdir)),
+                                 ['a.txt', 'b.txt'])
+            self.assertListEqual(sorted(entry.name for entry in validated_cache.list_directory(tempdir)),
+                                 ['a.txt', 'b.txt'])
+            self.assertEqual((validated_cache.hits, validated_cache.misses), (1, 2))
+
+
+class TestListingBudget(unittest.TestCase):
+    def test_rate_and_concurrency(self) -> None:
+        files = ['/data/2016/07/{:02d}/a.jpg'.format(day) for day in range(1, 11)]
+        backend = RecordingBackend(files=files, delay=0.01)
+
+        budget = datetime_glob.ListingBudget(listings_per_second=200.0, max_concurrent=2)
+
+        start = time.monotonic()
+        pths = [
+            pth for _, pth in datetime_glob.walk(
+                pattern='/data/%Y/%m/%d/*.jpg', backend=backend, read_ahead=8, budget=budget, path_type=str)
+        ]
+        duration = time.monotonic() - start
+
+        self.assertListEqual(pths, files)
+
+        # 13 listings at 200 listings per second after the initial token
+        self.assertGreaterEqual(duration, 12 / 200.0)
+        self.assertLessEqual(backend.max_in_progress, 2)
+
+        with self.assertRaises(ValueError):
+            _ = datetime_glob.ListingBudget(listings_per_second=0.0)
+
+    def test_pause_and_resume(self) -> None:
+        backend = datetime_glob.MemoryBackend(files=['/data/2016/a.jpg'])
+        budget = datetime_glob.ListingBudget()
+        budget.pause()
+        self.assertTrue(budget.paused)
+
+        pths = []  # type: List[str]
+
+        def run() -> None:
+            pths.extend(
+                pth for _, pth in datetime_glob.walk(
+                    pattern='/data/%Y/*.jpg', backend=backend, budget=budget, path_type=str))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+
+        thread.join(timeout=0.05)
+        self.assertTrue(thread.is_alive())
+        self.assertListEqual(pths, [])
+
+        budget.resume()
+        thread.join(timeout=5.0)
+        self.assertFalse(thread.is_alive())
+        self.assertListEqual(pths, ['/data/2016/a.jpg'])
+
+
+class TestMatchSet(unittest.TestCase):
+    def test_collect(self) -> None:
+        backend = datetime_glob.MemoryBackend(files=[
+            '/data/2016/7/10/cam1.jpg',
+            '/data/2016/7/10/cam2.jpg',
+            '/data/2016/7/9/cam1.jpg',
+            '/data/2016/8/1/cam1.jpg',
+        ])
+
+        match_set = datetime_glob.walk(pattern='/data/%Y/%-m/%-d/*.jpg', backend=backend).collect()
+        self.assertEqual(len(match_set), 4)
+        self.assertEqual(repr(match_set), 'MatchSet(len=4, directories=3, sorted=False)')
+
+        with self.assertRaises(ValueError):
+            _ = match_set.select(start=None, end=None)
+
+        match_set.sort()
+        self.assertListEqual([(mtch.as_date(), pth.as_posix()) for mtch, pth in match_set],
+                             [(datetime.date(2016, 7, 9), '/data/2016/7/9/cam1.jpg'),
+                              (datetime.date(2016, 7, 10), '/data/2016/7/10/cam1.jpg'),
+                              (datetime.date(2016, 7, 10), '/data/2016/7/10/cam2.jpg'),
+                              (datetime.date(2016, 8, 1), '/data/2016/8/1/cam1.jpg')])
+
+        selected = match_set.select(start=datetime.datetime(2016, 7, 10), end=datetime.datetime(2016, 8, 1))
+        self.assertListEqual([selected.path(i).as_posix() for i in range(len(selected))],
+                             ['/data/2016/7/10/cam1.jpg', '/data/2016/7/10/cam2.jpg'])
+        self.assertEqual(selected.timestamp(0), datetime.datetime(2016, 7, 10))
+
+        # the fields which are not set in the matches remain unset
+        partial_set = datetime_glob.walk(
+            pattern='/data/%Y/%-m/*/*.jpg', backend=backend, path_type=str).collect()
+        self.assertTrue(match_equal(partial_set[0][0], datetime_glob.Match(year=2016, month=7)))
+        self.assertEqual(partial_set[0][1], '/data/2016/7/10/cam1.jpg')
+
+        monthly_set = datetime_glob.MatchSet(path_type=str)
+        monthly_set.add(datetime_glob.Match(month=2, day=29), 'feb29.txt')
+        self.assertTrue(match_equal(monthly_set.match(0), datetime_glob.Match(month=2, day=29)))
+        self.assertEqual(monthly_set.path(0), 'feb29.txt')
+
+
+class TestFindGaps(unittest.TestCase):
+    def test_find_gaps(self) -> None:
+        start = datetime.datetime(2016, 2, 28, 23, 0)
+        step = datetime.timedelta(minutes=5)
+        dtimes = [start + i * step for i in range(60)]
+
+        missing = set(dtimes[0:2] + dtimes[10:13] + dtimes[59:])
+        duplicated = set(dtimes[20:22])
+
+        files = []  # type: List[str]
+        for dtime in dtimes:
+            if dtime in missing:
+                continue
+
+            files.append(dtime.strftime('/data/%Y/%m/%d/%H%M.jpg'))
+            files.append(dtime.strftime('/unordered/%Y/%-m/%-d/%H%M-a.jpg'))
+
+            if dtime in duplicated:
+                files.append(dtime.strftime('/unordered/%Y/%-m/%-d/%H%M-b.jpg'))
+
+        # off the grid
+        files.append((dtimes[30] + datetime.timedelta(minutes=1)).strftime('/data/%Y/%m/%d/%H%M.jpg'))
+
+        backend = datetime_glob.MemoryBackend(files=files)
+
+        # yapf: disable
+        table = [
+            ('/data/%Y/%m/%d/%H%M.jpg', [
+                ('missing', dtimes[0], dtimes[2], 2),
+                ('missing', dtimes[10], dtimes[13], 3),
+                ('missing', dtimes[59], dtimes[59] + step, 1),
+            ]),
+            ('/unordered/%Y/%-m/%-d/%H%M-*.jpg', [
+                ('missing', dtimes[0], dtimes[2], 2),
+                ('missing', dtimes[10], dtimes[13], 3),
+                ('duplicate', dtimes[20], dtimes[22], 2),
+                ('missing', dtimes[59], dtimes[59] + step, 1),
+            ])
+        ]
+        # yapf: enable
+
+        for pattern, expected in table:
+            gaps = datetime_glob.find_gaps(
+                pattern=pattern, start=start, end=start + 60 * step, step=step, backend=backend)
+
+            self.assertListEqual([(gap.kind, gap.start, gap.end, gap.count) for gap in gaps], expected, pattern)
+
+        with self.assertRaises(ValueError):
+            _ = list(
+                datetime_glob.find_gaps(
+                    pattern='/data/%H%M.jpg', start=start, end=start + step, step=step, backend=backend))
+
+
+class TestJoin(unittest.TestCase):
+    def test_join(self) -> None:
+        backend = datetime_glob.MemoryBackend(files=[
+            '/img/2016/07/03/100000.jpg',
+            '/img/2016/07/03/100500.jpg',
+            '/img/2016/07/03/101000.jpg',
+            '/img/2016/07/04/100000.jpg',
+            '/meta/20160703/100002.json',
+            '/meta/20160703/101000.json',
+            '/meta/20160705/100000.json',
+        ])
+
+        patterns = ['/img/%Y/%m/%d/%H%M%S.jpg', '/meta/%Y%m%d/%H%M%S.json']
+
+        def simplify(rows: Iterator[Tuple[Optional[Tuple[datetime_glob.Match, pathlib.Path]], ...]]
+                     ) -> List[Tuple[Optional[str], ...]]:
+            return [tuple(None if item is None else item[1].name for item in row) for row in rows]
+
+        self.assertListEqual(
+            simplify(datetime_glob.join(patterns=patterns, backend=backend)), [('101000.jpg', '101000.json')])
+
+        self.assertListEqual(
+            simplify(datetime_glob.join(patterns=patterns, tolerance=datetime.timedelta(seconds=5), backend=backend)),
+            [('100000.jpg', '100002.json'), ('101000.jpg', '101000.json')])
+
+        self.assertListEqual(
+            simplify(
+                datetime_glob.join(
+                    patterns=patterns, tolerance=datetime.timedelta(seconds=5), how='left', backend=backend)),
+            [('100000.jpg', '100002.json'), ('100500.jpg', None), ('101000.jpg', '101000.json'), ('100000.jpg', None)])
+
+        self.assertListEqual(
+            simplify(
+                datetime_glob.join(
+                    patterns=patterns,
+                    how='outer',
+                    start=datetime.datetime(2016, 7, 3, 10, 5),
+                    end=datetime.datetime(2016, 7, 6),
+                    backend=backend)),
+            [('100500.jpg', None), ('101000.jpg', '101000.json'), ('100000.jpg', None), (None, '100000.json')])
+
+        with self.assertRaises(ValueError):
+            _ = list(datetime_glob.join(patterns=patterns[:1], backend=backend))
+
+        with self.assertRaises(ValueError):
+            _ = list(datetime_glob.join(patterns=patterns, how='right', backend=backend))
+
+    def test_join_sorts_one_directory_at_a_time(self) -> None:
+        backend = RecordingBackend(files=[
+            '/img/2016/07/03/cam1_1200.jpg',
+            '/img/2016/07/03/cam2_1100.jpg',
+            '/img/2016/07/04/cam1_0900.jpg',
+            '/img/2016/07/05/cam1_0800.jpg',
+            '/meta/2016/07/03/1100.json',
+            '/meta/2016/07/03/1200.json',
+            '/meta/2016/07/04/0900.json',
+            '/meta/2016/07/05/0800.json',
+        ])
+
+        rows = datetime_glob.join(
+            patterns=['/img/%Y/%m/%d/cam*_%H%M.jpg', '/meta/%Y/%m/%d/%H%M.json'], how='outer', backend=backend)
+
+        first_row = next(rows)
+        self.assertListEqual([item[1].name for item in first_row if item is not None],
+                             ['cam2_1100.jpg', '1100.json'])
+
+        # the image directories are sorted one at a time instead of walking all of them up front
+        self.assertNotIn('/img/2016/07/05', backend.listed)
+
+        self.assertListEqual([tuple(item[1].name for item in row if item is not None) for row in rows],
+                             [('cam1_1200.jpg', '1200.json'), ('cam1_0900.jpg', '0900.json'),
+                              ('cam1_0800.jpg', '0800.json')])
+
+
+class TestArchive(unittest.TestCase):
+    def test_match_archive(self) -> None:
+        # pylint: disable=too-many-locals
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            members = {
+                '2016/10/03/21-22-23.txt': b'first',
+                '2016/10/04/11-12-13.txt': b'second',
+                '2016/10/04/unmatched.txt': b'unmatched',
+            }
+
+            zip_pth = tmppth / '2016-10.zip'
+            with zipfile.ZipFile(str(zip_pth), 'w') as zip_file:
+                for name, content in members.items():
+                    zip_file.writestr(name, content)
+
+            tar_pth = tmppth / '2016-10.tar'
+            with tarfile.open(str(tar_pth), 'w') as tar_file:
+                for name, content in members.items():
+                    tarinfo = tarfile.TarInfo(name=name)
+                    tarinfo.size = len(content)
+                    tar_file.addfile(tarinfo, io.BytesIO(content))
+
+            for archive_pth in [zip_pth, tar_pth]:
+                mtches_members = list(datetime_glob.match_archive(path=archive_pth, pattern='%Y/%m/%d/%H-%M-%S.txt'))
+
+                self.assertListEqual([(mtch.as_datetime(), member.name, member.size)
+                                      for mtch, member in mtches_members],
+                                     [(datetime.datetime(2016, 10, 3, 21, 22, 23), '2016/10/03/21-22-23.txt', 5),
+                                      (datetime.datetime(2016, 10, 4, 11, 12, 13), '2016/10/04/11-12-13.txt', 6)])
+
+                # the members can be opened after the matching finished
+                for _, member in mtches_members:
+                    with member.open() as fid:
+                        self.assertEqual(fid.read(), members[member.name])
+
+                with datetime_glob.ArchiveBackend(path=archive_pth) as backend:
+                    pths = [pth.as_posix() for _, pth in datetime_glob.walk(pattern='%Y/%m/*/*.txt', backend=backend)]
+                    self.assertListEqual(pths, sorted(members.keys()))
+
+            not_an_archive = tmppth / 'not-an-archive.txt'
+            not_an_archive.write_text('tested')
+            with self.assertRaises(ValueError):
+                _ = datetime_glob.ArchiveBackend(path=not_an_archive)
+
+
+class TestPlan(unittest.TestCase):
+    def test_explain(self) -> None:
+        matcher = datetime_glob.Matcher(pattern='/data/%Y/images/*%m/**/%d.jpg')
+        lines = matcher.explain().splitlines()
+
+        self.assertListEqual(lines, [
+            'pattern: /data/%Y/images/*%m/**/%d.jpg',
+            "fixed prefix: '/data'",
+            "level 0: '%Y', match, regex ^([0-9]{4})$, order-preserving",
+            "level 1: 'images', literal",
+            "level 2: '*%m', match, regex ^.*(0[1-9]|1[0-2])$",
+            "level 3: '**', recursive",
+            "level 4: '%d.jpg', match, regex ^(0[1-9]|1[0-9]|2[0-9]|3[0-1])\\.jpg$, order-preserving",
+        ])
+
+    def test_plan(self) -> None:
+        files = []  # type: List[str]
+        for year in [2016, 2017]:
+            for month in range(1, 13):
+                for day in range(1, 11):
+                    files.append('/data/{}/{:02d}/{:02d}/a.jpg'.format(year, month, day))
+
+        files.append('/data/unmatched/01/01/a.jpg')
+        backend = datetime_glob.MemoryBackend(files=files)
+
+        plan = datetime_glob.plan(pattern='/data/%Y/%m/%d/*.jpg', sample_size=1000, backend=backend)
+        self.assertEqual(plan.prefix, '/data')
+        self.assertListEqual([level.fan_out for level in plan.levels], [2.0, 12.0, 10.0, 1.0])
+        self.assertListEqual([level.estimated_listings for level in plan.levels], [1.0, 2.0, 24.0, 240.0])
+        self.assertEqual(plan.estimated_listings, 267.0)
+        self.assertIn('estimated listings: ~267', str(plan))
+
+        plan = datetime_glob.plan(pattern='/data/%Y/%m/%d/*.jpg', sample_size=2, backend=backend, seed=0)
+        self.assertListEqual([level.sampled for level in plan.levels], [1, 2, 2, 2])
+        self.assertEqual(plan.estimated_listings, 267.0)
+
+        plan = datetime_glob.plan(pattern='/data/**/%d/*.jpg', sample_size=2, backend=backend)
+        self.assertIsNone(plan.estimated_listings)
+
+
+class TestSample(unittest.TestCase):
+    def test_sample(self) -> None:
+        files = []  # type: List[str]
+        for year in [2016, 2017]:
+            for month in range(1, 13):
+                for day in range(1, 11):
+                    files.append('/data/{}/{:02d}/{:02d}/a.jpg'.format(year, month, day))
+
+        files.append('/data/unmatched/01/01/a.jpg')
+
+        backend = RecordingBackend(files=files)
+
+        drawn = datetime_glob.sample(pattern='/data/%Y/%m/%d/*.jpg', k=5, seed=0, backend=backend)
+        self.assertEqual(len(drawn), 5)
+        self.assertEqual(len(set(pth for _, pth in drawn)), 5)
+        self.assertLess(len(backend.listed), 30)
+        self.assertGreater(len(backend.listed), 0)
+        for mtch, pth in drawn:
+            self.assertEqual(pth, pathlib.Path(mtch.as_date().strftime('/data/%Y/%m/%d/a.jpg')))
+
+        again = datetime_glob.sample(pattern='/data/%Y/%m/%d/*.jpg', k=5, seed=0, backend=backend)
+        self.assertListEqual([pth for _, pth in again], [pth for _, pth in drawn])
+
+        drawn = datetime_glob.sample(
+            pattern='/data/%Y/%m/%d/*.jpg',
+            k=1000,
+            start=datetime.datetime(2017, 12, 5),
+            end=datetime.datetime(2018, 1, 1),
+            backend=backend)
+        self.assertListEqual(sorted(pth.parent.name for _, pth in drawn), ['05', '06', '07', '08', '09', '10'])
+
+        self.assertListEqual(datetime_glob.sample(pattern='/data/%Y/%m/%d/*.png', k=3, backend=backend), [])
+
+        with self.assertRaises(ValueError):
+            datetime_glob.sample(pattern='/data/%Y/%m/%d/*.jpg', k=-1, backend=backend)
+
+    def test_sample_with_empty_directories(self) -> None:
+        # the first matching directory holds no matching file, but its sibling does
+        backend = datetime_glob.MemoryBackend(files=['/x/a/2020/01.txt', '/x/a/2021/x.tmp'])
+        for seed in range(10):
+            drawn = datetime_glob.sample(pattern='/x/*/%Y/%m.txt', k=2, seed=seed, backend=backend)
+            self.assertListEqual([pth for _, pth in drawn], [pathlib.Path('/x/a/2020/01.txt')])
+
+        files = []  # type: List[str]
+        for day in range(1, 11):
+            for hour in range(24):
+                if (day * 24 + hour) % 7 == 0:
+                    files.append('/data/2016/07/{:02d}/{:02d}/x.tmp'.format(day, hour))
+                else:
+                    files.append('/data/2016/07/{:02d}/{:02d}/00.jpg'.format(day, hour))
+
+        backend = datetime_glob.MemoryBackend(files=files)
+        for seed in range(10):
+            drawn = datetime_glob.sample(pattern='/data/%Y/%m/%d/%H/%M.jpg', k=20, seed=seed, backend=backend)
+            self.assertEqual(len(set(pth for _, pth in drawn)), 20)
+
+
+class TestPrune(unittest.TestCase):
+    def test_prune(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            relative_pths = [
+                '2016/07/03/10-00-00.jpg',
+                '2016/07/03/notes.txt',
+                '2016/07/04/10-00-00.jpg',
+                '2016/07/04/13-00-00.jpg',
+                '2016/07/05/10-00-00.jpg',
+            ]
+
+            def populate() -> None:
+                shutil.rmtree(str(tmppth))
+                for relative_pth in relative_pths:
+                    pth = tmppth / relative_pth
+                    pth.parent.mkdir(parents=True, exist_ok=True)
+                    pth.write_text('tested')
+
+            def remaining() -> List[str]:
+                return sorted(pth.relative_to(tmppth).as_posix() for pth in tmppth.glob('**/*') if pth.is_file())
+
+            pattern = tmppth.as_posix() + '/%Y/%m/%d/%H-%M-%S.jpg'
+            older_than = datetime.datetime(2016, 7, 4, 12, 0, 0)
+
+            populate()
+            result = datetime_glob.prune(pattern=pattern, older_than=older_than)
+            self.assertTrue(result.dry_run)
+            self.assertEqual(result.files, 2)
+            self.assertListEqual([pathlib.Path(pth).relative_to(tmppth).as_posix() for pth in result.paths],
+                                 ['2016/07/03/10-00-00.jpg', '2016/07/04/10-00-00.jpg'])
+            self.assertListEqual(remaining(), relative_pths)
+
+            result = datetime_glob.prune(pattern=pattern, older_than=older_than, workers=2, dry_run=False)
+            self.assertEqual((result.files, result.directories, result.errors), (2, 0, []))
+            self.assertListEqual(
+                remaining(), ['2016/07/03/notes.txt', '2016/07/04/13-00-00.jpg', '2016/07/05/10-00-00.jpg'])
+
+            # the whole day before the cutoff is removed as a unit
+            populate()
+            result = datetime_glob.prune(pattern=pattern, older_than=older_than, dry_run=False, directories=True)
+            self.assertEqual((result.files, result.directories, result.errors), (1, 1, []))
+            self.assertFalse((tmppth / '2016/07/03').exists())
+            self.assertListEqual(remaining(), ['2016/07/04/13-00-00.jpg', '2016/07/05/10-00-00.jpg'])
+
+            with self.assertRaises(ValueError):
+                _ = datetime_glob.prune(pattern=tmppth.as_posix() + '/%m/%d/*.jpg', older_than=older_than)
+
+    def test_walk_collapse(self) -> None:
+        backend = datetime_glob.MemoryBackend(files=[
+            '/data/2016/07/03/a.jpg',
+            '/data/2016/07/03/b.jpg',
+            '/data/2016/07/04/c.jpg',
+            '/data/2016/07/05/d.jpg',
+        ])
+
+        wlk = datetime_glob.walk(
+            pattern='/data/%Y/%m/%d/*.jpg',
+            end=datetime.datetime(2016, 7, 4, 12),
+            collapse=True,
+            backend=backend,
+            path_type=str)
+
+        self.assertListEqual([(mtch.as_maybe_date(), pth, entry.is_dir) for mtch, pth, _, entry in wlk.entries()],
+                             [(datetime.date(2016, 7, 3), '/data/2016/07/03', True),
+                              (datetime.date(2016, 7, 4), '/data/2016/07/04/c.jpg', False)])
+
+        with self.assertRaises(ValueError):
+            _ = datetime_glob.walk(pattern='/data/%Y/%m/%d/*.jpg', collapse=True, backend=backend)
+
+
+class TestFormat(unittest.TestCase):
+    def test_matcher_format(self) -> None:
+        matcher = datetime_glob.Matcher(pattern='/some/{path}/%Y/%m/%-d/*_%H%M%S.%f?.jpg')
+
+        dtime = datetime.datetime(2016, 7, 3, 4, 5, 6, 7)
+        self.assertEqual(
+            matcher.format(dtime, wildcards=['cam1', 'x']), '/some/{path}/2016/07/3/cam1_040506.000007x.jpg')
+
+        pth = matcher.format(datetime_glob.Match(year=2016, month=7, day=3, hour=4, minute=5, second=6, microsecond=7),
+                             wildcards=['cam1', 'x'])
+        mtch = matcher.match(pth)
+        assert mtch is not None
+        self.assertEqual(mtch.as_datetime(), dtime)
+
+        self.assertEqual(datetime_glob.Matcher(pattern='%y%m%d.txt').format(dtime), '160703.txt')
+
+        with self.assertRaises(ValueError):
+            _ = matcher.format(datetime_glob.Match(year=2016, month=7), wildcards=['cam1', 'x'])
+
+        with self.assertRaises(ValueError):
+            _ = matcher.format(dtime)
+
+        with self.assertRaises(ValueError):
+            _ = datetime_glob.Matcher(pattern='/some/**/%Y.txt').format(dtime)
+
+        # '%y' can not render the years outside of 2000-2099 since they would be parsed back into another century
+        with self.assertRaises(ValueError):
+            _ = datetime_glob.Matcher(pattern='%y%m%d.txt').format(datetime.datetime(1999, 12, 31))
+
+    def test_relayout(self) -> None:
+        with tempfile.TemporaryDirectory() as tempdir:
+            tmppth = pathlib.Path(tempdir)
+
+            relative_pths = ['src/2016/07/03/10/cam1.jpg', 'src/2016/07/03/10/cam2.jpg', 'src/2016/07/03/11/cam1.jpg']
+            for relative_pth in relative_pths:
+                pth = tmppth / relative_pth
+                pth.parent.mkdir(parents=True, exist_ok=True)
+                pth.write_text(relative_pth)
+
+            def listing(directory: str) -> List[str]:
+                return sorted(pth.relative_to(tmppth).as_posix() for pth in (tmppth / directory).glob('**/*')
+                              if pth.is_file())
+
+            src_pattern = tmppth.as_posix() + '/src/%Y/%m/%d/%H/*.jpg'
+
+            result = datetime_glob.relayout(
+                src_pattern=src_pattern, dst_pattern=tmppth.as_posix() + '/link/%Y%m/%d%H_*.jpg', mode='link')
+            self.assertEqual((result.files, result.directories, result.errors), (3, 1, []))
+            self.assertListEqual(
+                listing('link'),
+                ['link/201607/0310_cam1.jpg', 'link/201607/0310_cam2.jpg', 'link/201607/0311_cam1.jpg'])
+            self.assertEqual((tmppth / 'link/201607/0310_cam2.jpg').read_text(), 'src/2016/07/03/10/cam2.jpg')
+
+            result = datetime_glob.relayout(
+                src_pattern=src_pattern, dst_pattern=tmppth.as_posix() + '/flat/%Y%m%d%H*.jpg', workers=2)
+            self.assertEqual((result.files, result.errors), (3, []))
+            self.assertListEqual(listing('src'), [])
+            self.assertListEqual(
+                listing('flat'), ['flat/2016070310cam1.jpg', 'flat/2016070310cam2.jpg', 'flat/2016070311cam1.jpg'])
+
+            # the destination drops the hour so that the second file of the day collides with the first one
+            result = datetime_glob.relayout(
+                src_pattern=tmppth.as_posix() + '/flat/%Y%m%d%H*.jpg',
+                dst_pattern=tmppth.as_posix() + '/day/%Y%m%d_*.jpg')
+            self.assertEqual(result.files, 2)
+            self.assertEqual(len(result.errors), 1)
+            self.assertIsInstance(result.errors[0][1], FileExistsError)
+            self.assertListEqual(listing('flat'), ['flat/2016070311cam1.jpg'])
+            self.assertListEqual(listing('day'), ['day/20160703_cam1.jpg', 'day/20160703_cam2.jpg'])
+            self.assertEqual((tmppth / 'day/20160703_cam1.jpg').read_text(), 'src/2016/07/03/10/cam1.jpg')
+
+            # the later file can not be rendered with '%y', but the earlier one has been moved already
+            for relative_pth in ['century/2001/01/01/a.jpg', 'century/2100/01/01/b.jpg']:
+                pth = tmppth / relative_pth
+                pth.parent.mkdir(parents=True, exist_ok=True)
+                pth.write_text(relative_pth)
+
+            result = datetime_glob.relayout(
+                src_pattern=tmppth.as_posix() + '/century/%Y/%m/%d/*.jpg',
+                dst_pattern=tmppth.as_posix() + '/short/%y%m%d_*.jpg')
+            self.assertEqual(result.files, 1)
+            self.assertListEqual([(pathlib.Path(pth).relative_to(tmppth).as_posix(), type(err))
+                                  for pth, err in result.errors], [('century/2100/01/01/b.jpg', ValueError)])
+            self.assertListEqual(listing('short'), ['short/010101_a.jpg'])
+            self.assertListEqual(listing('century'), ['century/2100/01/01/b.jpg'])
+
+            # the destination needs the minute which the source does not provide
+            with self.assertRaises(ValueError):
+                _ = datetime_glob.relayout(src_pattern=src_pattern, dst_pattern='/dst/%Y%m%d%H%M*.jpg')
+
+            # the destination drops the wildcard of the source
+            with self.assertRaises(ValueError):
+                _ = datetime_glob.relayout(src_pattern=src_pattern, dst_pattern='/dst/%Y%m%d%H.jpg')
+
 
 if __name__ == '__main__':
     unittest.main()